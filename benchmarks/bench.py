@@ -0,0 +1,132 @@
+"""
+解码与分发热路径的基准测试, 在仓库根目录执行:
+    python -m benchmarks.bench --count 20000 --output bench.json
+输出为JSON, 便于比较不同提交之间的性能变化
+"""
+import sys
+import json
+import asyncio
+import argparse
+import platform
+from time import perf_counter_ns
+
+from src.crawler import Header, BaseLiveMessage, Live
+from src.messages import MESSAGES
+from src.log import void_loger
+
+from .frames import HOT_ROOM_MIX, load_samples, frames, brotli
+
+WANTED = ('DANMU_MSG', 'SEND_GIFT', 'SUPER_CHAT_MESSAGE', 'GUARD_BUY')
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def measure(name: str, config: dict, items: list, func, sizes: list, repeat: int) -> dict:
+    """
+    对items中的每一项调用func, sizes为每一项包含的消息数, 用于换算单条消息的耗时
+    """
+    per_msg = []
+    best = None
+    for _ in range(repeat):
+        start = perf_counter_ns()
+        for item, size in zip(items, sizes):
+            t = perf_counter_ns()
+            func(item)
+            per_msg.append((perf_counter_ns() - t) / size)
+        elapsed = perf_counter_ns() - start
+        best = elapsed if best is None else min(best, elapsed)
+    messages = sum(sizes)
+    return {
+        'name': name,
+        'config': config,
+        'messages': messages,
+        'seconds': best / 1e9,
+        'msgs_per_sec': messages / (best / 1e9),
+        'ns_per_msg_p50': percentile(per_msg, 0.5),
+        'ns_per_msg_p99': percentile(per_msg, 0.99),
+    }
+
+
+def bench_dispatch(config: dict, msgs: list, repeat: int) -> dict:
+    live = Live(0, web=BaseLiveMessage(0, void_loger))
+
+    async def handler(msg):
+        pass
+
+    for cmd in WANTED:
+        live.register(cmd)(handler)
+    loop = asyncio.new_event_loop()
+    batches = [msgs[i:i + Live.BATCH_SIZE] for i in range(0, len(msgs), Live.BATCH_SIZE)]
+
+    async def run_batch(batch):
+        live._dispatch_batch(batch)
+        while live._tasks:
+            await asyncio.sleep(0)
+
+    result = measure('live_dispatch', config, batches, lambda batch: loop.run_until_complete(run_batch(batch)),
+                     [len(batch) for batch in batches], repeat)
+    loop.close()
+    return result
+
+
+def run(count: int, batches: list, compressions: list, mix: dict, repeat: int) -> list:
+    samples = load_samples()
+    web = BaseLiveMessage(0, void_loger)
+    results = []
+    for compression in compressions:
+        for batch in batches:
+            config = {'batch': batch, 'compression': compression, 'count': count}
+            frame_list = frames(samples, count, batch, compression, mix)
+            sizes = [min(batch, count - i * batch) for i in range(len(frame_list))]
+            results.append(measure('header', config, frame_list, Header, [1] * len(frame_list), repeat))
+            results.append(measure('decode_msg', config, frame_list, lambda f: list(web.decode_msg(f)), sizes, repeat))
+            results.append(measure('recv_msg_json', config, frame_list, web.parse_msg, sizes, repeat))
+
+            def lazy(f):
+                return [web.load(body) for cmd, body in web.split_msg(f) if cmd in WANTED]
+
+            results.append(measure('lazy_json', config, frame_list, lazy, sizes, repeat))
+
+    msgs = [msg for f in frames(samples, count, 100, 'none', mix) for msg in web.parse_msg(f)]
+    config = {'count': len(msgs)}
+
+    def build(msg):
+        model = MESSAGES.get(msg['cmd'])
+        if model is not None:
+            str(model(msg))
+
+    results.append(measure('message_model', config, msgs, build, [1] * len(msgs), repeat))
+    results.append(bench_dispatch(config, msgs, repeat))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='BiLiveir 解码/分发基准测试')
+    parser.add_argument('--count', type=int, default=10000, help='每组测试的消息数量')
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 20, 100], help='每帧拼接的消息数量')
+    parser.add_argument('--compression', nargs='+', default=None, help='none / zlib / brotli')
+    parser.add_argument('--mix', choices=('hot', 'uniform'), default='hot', help='cmd比例')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None, help='输出文件, 不填则输出到标准输出')
+    args = parser.parse_args(argv)
+
+    compressions = args.compression or (['none', 'zlib', 'brotli'] if brotli is not None else ['none', 'zlib'])
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': run(args.count, args.batch, compressions, HOT_ROOM_MIX if args.mix == 'hot' else None,
+                       args.repeat),
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+JSON编解码器基准测试, 使用CmdJsonExample中的真实消息, 在仓库根目录执行:
+    python -m benchmarks.bench_codec --repeat 5 --output codec.json
+解码直接从memoryview读取(与BaseLiveMessage.decode_msg返回的包体一致), 输出各编解码器的吞吐量与推荐结果
+"""
+import sys
+import json
+import argparse
+import platform
+from time import perf_counter_ns
+
+from src.codec import CODECS, available, get_codec
+
+from .frames import HOT_ROOM_MIX, load_samples, pick_bodies
+
+
+def measure(func, items: list, repeat: int) -> int:
+    """
+    :return: repeat次中最快一次的总耗时(纳秒)
+    """
+    best = None
+    for _ in range(repeat):
+        start = perf_counter_ns()
+        for item in items:
+            func(item)
+        elapsed = perf_counter_ns() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(count: int, mix: dict, repeat: int) -> dict:
+    samples = load_samples()
+    bodies = pick_bodies(samples, count, mix)
+    views = [memoryview(body) for body in bodies]
+    expected = [json.loads(body) for body in bodies]
+    total_bytes = sum(len(body) for body in bodies)
+    results = []
+    for name in available():
+        codec = get_codec(name)
+        decoded = [codec.loads(view) for view in views]
+        decode_ns = measure(codec.loads, views, repeat)
+        encode_ns = measure(codec.dumps, expected, repeat)
+        results.append({
+            'codec': name,
+            'messages': len(bodies),
+            'correct': decoded == expected,
+            'decode_ns_per_msg': decode_ns / len(bodies),
+            'decode_mb_per_sec': total_bytes / (decode_ns / 1e9) / 1e6,
+            'encode_ns_per_msg': encode_ns / len(bodies),
+        })
+    baseline = next(result for result in results if result['codec'] == 'json')
+    for result in results:
+        result['decode_speedup'] = baseline['decode_ns_per_msg'] / result['decode_ns_per_msg']
+    correct = [result for result in results if result['correct']]
+    return {
+        'installed': [result['codec'] for result in results],
+        'missing': [name for name in CODECS if name not in available()],
+        'recommended': min(correct, key=lambda result: result['decode_ns_per_msg'])['codec'],
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='BiLiveir JSON编解码器基准测试')
+    parser.add_argument('--count', type=int, default=20000, help='测试的消息数量')
+    parser.add_argument('--mix', choices=('hot', 'uniform'), default='hot', help='cmd比例')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None, help='输出文件, 不填则输出到标准输出')
+    args = parser.parse_args(argv)
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        **run(args.count, HOT_ROOM_MIX if args.mix == 'hot' else None, args.repeat),
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
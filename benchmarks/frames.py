@@ -0,0 +1,89 @@
+"""
+根据CmdJsonExample中的真实消息生成协议帧
+"""
+import os
+import json
+import zlib
+import random
+from struct import pack
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'CmdJsonExample')
+
+# 热门直播间中常见的cmd比例
+HOT_ROOM_MIX = {
+    'DANMU_MSG': 30,
+    'INTERACT_WORD': 30,
+    'ONLINE_RANK_COUNT': 5,
+    'LIKE_INFO_V3_UPDATE': 5,
+    'LIKE_INFO_V3_CLICK': 5,
+    'WATCHED_CHANGE': 5,
+    'SEND_GIFT': 8,
+    'COMBO_SEND': 3,
+    'ENTRY_EFFECT': 3,
+    'SUPER_CHAT_MESSAGE': 1,
+    'GUARD_BUY': 1,
+    'WIDGET_BANNER': 2,
+    'STOP_LIVE_ROOM_LIST': 2,
+}
+
+
+def load_samples(example_dir: str = EXAMPLE_DIR) -> dict:
+    """
+    :return: cmd到该cmd所有示例(已编码为bytes)的映射
+    """
+    samples = {}
+    for cmd in sorted(os.listdir(example_dir)):
+        cmd_dir = os.path.join(example_dir, cmd)
+        if cmd == 'HEART_BEAT_REPLY' or not os.path.isdir(cmd_dir):
+            continue
+        bodies = []
+        for name in sorted(os.listdir(cmd_dir)):
+            with open(os.path.join(cmd_dir, name), encoding='utf-8') as f:
+                bodies.append(json.dumps(json.load(f), ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        samples[cmd] = bodies
+    return samples
+
+
+def packet(body: bytes, protover: int = 0, operation: int = 5) -> bytes:
+    return pack('>IHHII', 16 + len(body), 16, protover, operation, 0) + body
+
+
+def pick_bodies(samples: dict, count: int, mix: dict = None, seed: int = 0) -> list:
+    """
+    按cmd比例随机抽取count个包体, mix为None时所有cmd等比例
+    """
+    rng = random.Random(seed)
+    mix = {cmd: 1 for cmd in samples} if mix is None else {cmd: w for cmd, w in mix.items() if cmd in samples}
+    cmds = rng.choices(list(mix), weights=list(mix.values()), k=count)
+    return [rng.choice(samples[cmd]) for cmd in cmds]
+
+
+def frame(bodies: list, compression: str = 'zlib') -> bytes:
+    """
+    将多个包体拼接为一帧
+    :param compression: 'none'、'zlib'或'brotli'
+    """
+    inner = b''.join(packet(body) for body in bodies)
+    if compression == 'none':
+        return inner
+    if compression == 'zlib':
+        return packet(zlib.compress(inner), protover=2)
+    if compression == 'brotli':
+        if brotli is None:
+            raise RuntimeError('未安装brotli模块')
+        return packet(brotli.compress(inner), protover=3)
+    raise ValueError(f'未知压缩方式: {compression}')
+
+
+def frames(samples: dict, count: int, batch: int = 1, compression: str = 'zlib', mix: dict = None,
+           seed: int = 0) -> list:
+    """
+    生成count条消息, 每batch条拼为一帧
+    """
+    bodies = pick_bodies(samples, count, mix, seed)
+    return [frame(bodies[i:i + batch], compression) for i in range(0, count, batch)]
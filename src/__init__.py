@@ -1,3 +1,11 @@
 from .crawler import Live
-from .messages import DanmuMsg, SuperChatMessage
+from .hub import LiveHub
+from .shard import ShardedHub
+from .pool import MessagePool
+from .metrics import Metrics
+from .analytics import Analytics
+from .sink import Sink
+from .sampler import SchemaSampler
+from .live_pusher import LivePusher
+from .messages import DanmuMsg, SuperChatMessage, Message, MESSAGES
 from .log import Log
@@ -0,0 +1,201 @@
+from time import monotonic
+
+from .messages import MESSAGES
+
+DANMU_CMDS = ('DANMU_MSG',)
+REVENUE_CMDS = ('SEND_GIFT', 'SUPER_CHAT_MESSAGE', 'GUARD_BUY')
+
+
+class SlidingCounter:
+    """
+    环形分桶的滑动窗口计数, 内存固定为buckets个桶
+    """
+    __slots__ = ('window', 'width', 'counts', 'stamps')
+
+    def __init__(self, window: float = 60.0, buckets: int = 60):
+        self.window = window
+        self.width = window / buckets
+        self.counts = [0] * buckets
+        self.stamps = [-1] * buckets
+
+    def add(self, value=1, now: float = None):
+        stamp = int((monotonic() if now is None else now) / self.width)
+        index = stamp % len(self.counts)
+        if self.stamps[index] != stamp:
+            self.stamps[index] = stamp
+            self.counts[index] = 0
+        self.counts[index] += value
+
+    def total(self, now: float = None):
+        oldest = int((monotonic() if now is None else now) / self.width) - len(self.counts)
+        return sum(count for count, stamp in zip(self.counts, self.stamps) if stamp > oldest)
+
+    def rate(self, per: float = 60.0, now: float = None) -> float:
+        """
+        窗口内平均每per秒的数量
+        """
+        return self.total(now) * per / self.window
+
+
+class SpaceSaving:
+    """
+    Space-Saving算法的近似Top-K, 最多保存capacity个元素, 计数的高估量不超过error
+    """
+    __slots__ = ('capacity', 'counts', 'errors', 'labels')
+
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.labels = {}  # 元素 -> 显示名, 如uid -> 用户名
+
+    def add(self, item, weight=1, label=None):
+        counts = self.counts
+        if item in counts:
+            counts[item] += weight
+        elif len(counts) < self.capacity:
+            counts[item] = weight
+            self.errors[item] = 0
+        else:
+            victim = min(counts, key=counts.get)
+            floor = counts.pop(victim)
+            del self.errors[victim]
+            self.labels.pop(victim, None)
+            counts[item] = floor + weight
+            self.errors[item] = floor
+        if label is not None:
+            self.labels[item] = label
+
+    def top(self, k: int) -> list:
+        """
+        :return: [(元素, 显示名, 计数, 最大高估量), ...], 按计数从大到小
+        """
+        ranked = sorted(self.counts.items(), key=lambda pair: pair[1], reverse=True)[:k]
+        return [(item, self.labels.get(item), count, self.errors[item]) for item, count in ranked]
+
+
+class _RotatingTop:
+    """
+    每个窗口轮换一次的两个SpaceSaving, 查询时合并, 近似最近一到两个窗口的Top-K
+    """
+    __slots__ = ('window', 'capacity', 'current', 'previous', 'started')
+
+    def __init__(self, window: float, capacity: int):
+        self.window = window
+        self.capacity = capacity
+        self.current = SpaceSaving(capacity)
+        self.previous = SpaceSaving(capacity)
+        self.started = monotonic()
+
+    def _rotate(self, now: float):
+        if now - self.started >= self.window:
+            self.previous = self.current if now - self.started < self.window * 2 else SpaceSaving(self.capacity)
+            self.current = SpaceSaving(self.capacity)
+            self.started = now
+
+    def add(self, item, weight, label, now: float):
+        self._rotate(now)
+        self.current.add(item, weight, label)
+
+    def top(self, k: int, now: float) -> list:
+        self._rotate(now)
+        merged = {}
+        for sketch in (self.previous, self.current):
+            for item, label, count, error in sketch.top(self.capacity):
+                old = merged.get(item)
+                merged[item] = (item, label or (old and old[1]), count + (old[2] if old else 0),
+                                error + (old[3] if old else 0))
+        return sorted(merged.values(), key=lambda entry: entry[2], reverse=True)[:k]
+
+
+class RoomStats:
+    """
+    单个房间的统计, 内存固定
+    """
+
+    def __init__(self, window: float, buckets: int, capacity: int):
+        self.danmaku = SlidingCounter(window, buckets)
+        self.revenue = SlidingCounter(window, buckets)  # 金瓜子
+        self.paid = SlidingCounter(window, buckets)
+        self.chatters = _RotatingTop(window, capacity)
+        self.gifters = _RotatingTop(window, capacity)  # 按金瓜子
+        self.total_danmaku = 0
+        self.total_revenue = 0
+
+
+class Analytics:
+    """
+    按房间统计弹幕速率、窗口内营收以及近似的活跃用户与送礼用户Top-K
+    通过Live.observe在分发时同步统计, 不创建任务, lazy_json模式下只解析用到的cmd
+    snapshot可在任意线程调用, 与统计同时进行时结果可能有极少量不一致
+    """
+
+    def __init__(self, window: float = 60.0, buckets: int = 60, top_k: int = 10, capacity: int = 100):
+        """
+        :param window: 滑动窗口长度(秒)
+        :param buckets: 每个窗口的分桶数, 越多越精确
+        :param top_k: 快照中的Top-K数量
+        :param capacity: 每个近似Top-K保存的元素数, 越大越精确
+        """
+        self.window = window
+        self.buckets = buckets
+        self.top_k = top_k
+        self.capacity = capacity
+        self.rooms = {}
+
+    def attach(self, live):
+        """
+        统计Live或LiveHub的消息, 单个Live的消息按其房间号统计
+        """
+        room_id = getattr(live, 'room_id', None)
+        for cmd in DANMU_CMDS + REVENUE_CMDS:
+            live.observe(cmd, lambda msg, default=room_id: self.observe(msg, default))
+        return self
+
+    def room(self, room_id) -> RoomStats:
+        stats = self.rooms.get(room_id)
+        if stats is None:
+            stats = self.rooms[room_id] = RoomStats(self.window, self.buckets, self.capacity)
+        return stats
+
+    def observe(self, msg: dict, room_id=None):
+        cmd = msg.get('cmd')
+        stats = self.room(msg.get('room_id', room_id))
+        now = monotonic()
+        data = MESSAGES[cmd](msg)
+        if cmd in DANMU_CMDS:
+            stats.danmaku.add(1, now)
+            stats.total_danmaku += 1
+            stats.chatters.add(data.uid, 1, data.name, now)
+        else:
+            coin = data.coin
+            if coin:
+                stats.revenue.add(coin, now)
+                stats.paid.add(1, now)
+                stats.total_revenue += coin
+                stats.gifters.add(data.uid, coin, data.name, now)
+
+    def snapshot(self) -> dict:
+        """
+        所有房间的快照, 房间号 -> room_snapshot
+        """
+        return {room_id: self.room_snapshot(room_id) for room_id in list(self.rooms)}
+
+    def room_snapshot(self, room_id) -> dict:
+        stats = self.rooms.get(room_id)
+        if stats is None:
+            return {}
+        now = monotonic()
+        revenue = stats.revenue.total(now)
+        return {
+            'window': self.window,
+            'danmaku': stats.danmaku.total(now),
+            'danmaku_per_minute': stats.danmaku.rate(60, now),
+            'revenue_coin': revenue,
+            'revenue': revenue / 1000,
+            'paid_messages': stats.paid.total(now),
+            'total_danmaku': stats.total_danmaku,
+            'total_revenue': stats.total_revenue / 1000,
+            'top_chatters': stats.chatters.top(self.top_k, now),
+            'top_gifters': stats.gifters.top(self.top_k, now),
+        }
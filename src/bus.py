@@ -0,0 +1,248 @@
+import os
+import json
+import pickle
+import marshal
+import socket
+import asyncio
+from struct import Struct
+from typing import Iterator
+
+from .log import Log, void_loger
+from .crawler import BaseLive, shared_loop
+
+LENGTH = Struct('>I')
+
+
+def _json_dumps(msg: dict) -> bytes:
+    return json.dumps(msg, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _pickle_dumps(msg: dict) -> bytes:
+    return pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+
+
+# 编码名 -> (编码函数, 解码函数), marshal与pickle更紧凑、更快, 但订阅端也必须是Python
+CODECS = {
+    'json': (_json_dumps, json.loads),
+    'marshal': (marshal.dumps, marshal.loads),
+    'pickle': (_pickle_dumps, pickle.loads),
+}
+
+
+class _Client:
+    __slots__ = ('writer', 'cmds', 'dropped')
+
+    def __init__(self, writer: asyncio.StreamWriter, cmds: set = None):
+        self.writer = writer
+        self.cmds = cmds  # None为订阅所有cmd
+        self.dropped = 0
+
+
+class Publisher:
+    """
+    通过Unix域套接字把一个Live解析好的消息转发给多个订阅者, 多个程序只需一条直播间连接、解析一次
+    协议: 订阅者连接后发送一行JSON {"cmds": [...]}, 发布者回复一行JSON {"codec": ...},
+    之后每条消息为4字节长度 + 编码后的消息; 订阅者随时可以再发送一行JSON修改订阅的cmd
+    """
+
+    def __init__(self, path: str = 'bilive.sock', codec: str = 'json', max_buffer: int = 4 * 1024 * 1024,
+                 loop: asyncio.AbstractEventLoop = None, logger: Log = void_loger):
+        """
+        :param path: Unix域套接字路径
+        :param codec: 消息编码, 见CODECS
+        :param max_buffer: 每个订阅者的最大发送缓冲(字节), 订阅者读取过慢时丢弃发给它的消息, 不影响其他订阅者
+        :param loop: 运行套接字服务的事件循环, 不填则使用进程内共享的事件循环
+        """
+        if codec not in CODECS:
+            raise ValueError(f'未知编码: {codec}, 可选: {tuple(CODECS)}')
+        self.path = path
+        self.codec = codec
+        self.max_buffer = max_buffer
+        self.loop = loop
+        self.logger = logger
+        self.clients = set()
+        self._encode = CODECS[codec][0]
+        self._server = None
+
+    def attach(self, live: BaseLive):
+        """
+        将Live或LiveHub的消息转发给订阅者, 未调用start时自动启动
+        """
+        if self._server is None:
+            self.start()
+        live.tap(self.publish)
+        return self
+
+    def start(self):
+        if self.loop is None:
+            self.loop = shared_loop()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        asyncio.run_coroutine_threadsafe(self._serve(), self.loop).result()
+        return self
+
+    async def _serve(self):
+        self._server = await asyncio.start_unix_server(self._accept, self.path)
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client = _Client(writer)
+        try:
+            line = await reader.readline()
+            writer.write(json.dumps({'codec': self.codec}).encode('utf-8') + b'\n')
+            self.clients.add(client)
+            self.logger.info(f'订阅者已连接, 当前 {len(self.clients)} 个')
+            while line:
+                request = json.loads(line or b'{}')
+                client.cmds = set(request['cmds']) if request.get('cmds') else None
+                line = await reader.readline()
+        except (ConnectionError, ValueError) as e:
+            self.logger.warn(f'订阅者异常断开: {e!r}')
+        finally:
+            self.clients.discard(client)
+            writer.close()
+
+    def publish(self, msgs: list):
+        """
+        发布一批消息, 可在任意线程中调用
+        """
+        if not self.clients or not msgs:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._broadcast(msgs)
+        else:
+            self.loop.call_soon_threadsafe(self._broadcast, msgs)
+
+    def _broadcast(self, msgs: list):
+        encode = self._encode
+        frames = [None] * len(msgs)
+        for client in list(self.clients):
+            parts = []
+            for i, msg in enumerate(msgs):
+                if client.cmds is None or msg.get('cmd') in client.cmds:
+                    frame = frames[i]
+                    if frame is None:
+                        data = encode(msg)
+                        frame = frames[i] = LENGTH.pack(len(data)) + data
+                    parts.append(frame)
+            if not parts:
+                continue
+            transport = client.writer.transport
+            if transport.is_closing():
+                continue
+            if transport.get_write_buffer_size() > self.max_buffer:
+                client.dropped += len(parts)
+                continue
+            client.writer.write(b''.join(parts))
+
+    async def _close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for client in list(self.clients):
+            client.writer.close()
+        self.clients.clear()
+
+    def close(self):
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._close(), self.loop).result()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Subscriber:
+    """
+    Publisher的阻塞式订阅客户端, 迭代即可逐条获得消息字典
+    """
+
+    def __init__(self, path: str = 'bilive.sock', cmds: list = None, timeout: float = None):
+        """
+        :param cmds: 订阅的cmd, 不填则订阅所有cmd
+        :param timeout: 接收超时(秒), 超时抛出socket.timeout
+        """
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self._file = self.sock.makefile('rb')
+        self.subscribe(cmds)
+        self.codec = json.loads(self._file.readline())['codec']
+        self._decode = CODECS[self.codec][1]
+
+    def subscribe(self, cmds: list = None):
+        """
+        修改订阅的cmd
+        """
+        self.sock.sendall(json.dumps({'cmds': list(cmds or ())}).encode('utf-8') + b'\n')
+
+    def recv(self) -> dict:
+        """
+        接收一条消息, 发布者关闭时抛出EOFError
+        """
+        header = self._file.read(LENGTH.size)
+        if len(header) < LENGTH.size:
+            raise EOFError('发布者已关闭')
+        data = self._file.read(LENGTH.unpack(header)[0])
+        return self._decode(data)
+
+    def __iter__(self) -> Iterator[dict]:
+        while True:
+            try:
+                yield self.recv()
+            except EOFError:
+                return
+
+    def close(self):
+        self._file.close()
+        self.sock.close()
+
+
+class AsyncSubscriber:
+    """
+    Publisher的异步订阅客户端, 使用async for逐条获得消息字典
+    """
+
+    def __init__(self, path: str = 'bilive.sock', cmds: list = None):
+        self.path = path
+        self.cmds = cmds
+        self.codec = None
+        self._reader = None
+        self._writer = None
+        self._decode = None
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+        await self.subscribe(self.cmds)
+        self.codec = json.loads(await self._reader.readline())['codec']
+        self._decode = CODECS[self.codec][1]
+        return self
+
+    async def subscribe(self, cmds: list = None):
+        self.cmds = cmds
+        self._writer.write(json.dumps({'cmds': list(cmds or ())}).encode('utf-8') + b'\n')
+        await self._writer.drain()
+
+    async def recv(self) -> dict:
+        try:
+            header = await self._reader.readexactly(LENGTH.size)
+            data = await self._reader.readexactly(LENGTH.unpack(header)[0])
+        except asyncio.IncompleteReadError:
+            raise EOFError('发布者已关闭')
+        return self._decode(data)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        try:
+            return await self.recv()
+        except EOFError:
+            raise StopAsyncIteration
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
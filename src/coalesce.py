@@ -0,0 +1,102 @@
+import asyncio
+from time import time
+from typing import Callable
+
+from .messages import MESSAGES, Message
+
+
+def _gift_key(data) -> tuple:
+    return data.msg['data'].get('batch_combo_id') or (data.uid, data.gift_id)
+
+
+# cmd -> (合并键, 数量是否为累计值), 数量为累计值时取最后一条的gift_num, 否则求和
+RULES = {
+    'DANMU_MSG': (lambda data: data.message, False),
+    'DANMU_AGGREGATION': (lambda data: data.message, True),
+    'SEND_GIFT': (_gift_key, False),
+    'COMBO_SEND': (lambda data: data.combo_id, True),
+}
+
+
+class Coalesced:
+    """
+    时间窗口内合并后的事件, 传递给live.coalesce注册的消息处理器
+    """
+    __slots__ = ('cmd', 'key', 'first', 'last', 'count', 'num', 'coin', 'uids', '_uid_set', 'first_time', 'last_time')
+
+    def __init__(self, cmd: str, key, data: Message, now: float):
+        self.cmd = cmd
+        self.key = key  # 合并键, 如弹幕内容或连击ID
+        self.first = data  # 第一条消息, 消息类对象
+        self.last = data  # 最后一条消息
+        self.count = 0  # 合并的消息数
+        self.num = 0  # 礼物数量, 弹幕为消息数
+        self.coin = 0  # 金瓜子总数
+        self.uids = []  # 发送者uid, 按首次出现的顺序去重
+        self._uid_set = set()
+        self.first_time = now
+        self.last_time = now
+
+    def add(self, data: Message, now: float, cumulative: bool):
+        self.last = data
+        self.last_time = now
+        self.count += 1
+        if cumulative:
+            self.num = getattr(data, 'gift_num', None) or self.count
+            self.coin = data.coin or getattr(data, 'total_coin', 0) or 0
+        else:
+            self.num += getattr(data, 'gift_num', None) or 1
+            self.coin += data.coin
+        uid = getattr(data, 'uid', None)
+        if uid is not None and uid not in self._uid_set:
+            self._uid_set.add(uid)
+            self.uids.append(uid)
+
+    @property
+    def room_id(self):
+        return self.first.room_id
+
+    def get(self, key, default=None):
+        """
+        与原始消息字典一致的get, 供按cmd保序等选项使用
+        """
+        return self.first.msg.get(key, default)
+
+    def __repr__(self):
+        return f'[合并 {self.cmd}]{self.first} × {self.count} ({len(self.uids)}人, {self.last_time - self.first_time:.1f}秒)'
+
+
+class Coalescer:
+    """
+    注册在分发表中的合并入口, 同一合并键的消息在窗口内只累计, 窗口结束时为消息处理器创建一个任务, 自身不创建任务
+    窗口从该键的第一条消息开始计时, 时间为本地收到消息的时间
+    """
+    __slots__ = ('live', 'cmd', 'window', 'coro', 'match', 'model', 'key', 'cumulative', 'pending')
+
+    def __init__(self, live, cmd: str, window: float, coro, match: Callable = None):
+        self.live = live
+        self.cmd = cmd
+        self.window = window
+        self.coro = coro
+        self.match = match
+        self.model = MESSAGES.get(cmd, Message)
+        self.key, self.cumulative = RULES.get(cmd, (lambda data: str(data), False))
+        self.pending = {}  # (房间号, 合并键) -> Coalesced
+
+    def __call__(self, msg: dict):
+        if self.match is not None and not self.match(msg):
+            return None
+        data = self.model(msg)
+        key = (msg.get('room_id'), self.key(data))
+        now = time()
+        event = self.pending.get(key)
+        if event is None:
+            event = self.pending[key] = Coalesced(self.cmd, key[1], data, now)
+            asyncio.get_running_loop().call_later(self.window, self.flush, key)
+        event.add(data, now, self.cumulative)
+        return None
+
+    def flush(self, key):
+        event = self.pending.pop(key, None)
+        if event is not None:
+            self.live._create_task(self.coro(event))
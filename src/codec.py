@@ -0,0 +1,97 @@
+import json
+from typing import Callable, Any
+
+PREFERENCE = ('orjson', 'msgspec', 'ujson', 'json')  # 不指定时按此顺序选择第一个已安装的编解码器
+
+
+class Codec:
+    """
+    JSON编解码器, loads接受bytes或memoryview, dumps返回UTF-8编码的bytes
+    """
+    __slots__ = ('name', 'loads', '_dumps', '_pretty')
+
+    def __init__(self, name: str, loads: Callable[[Any], Any], dumps: Callable[[Any], bytes],
+                 pretty: Callable[[Any], bytes]):
+        self.name = name
+        self.loads = loads
+        self._dumps = dumps
+        self._pretty = pretty
+
+    def dumps(self, obj, pretty: bool = False) -> bytes:
+        """
+        :param pretty: 为True时缩进两格输出, 便于阅读
+        """
+        return self._pretty(obj) if pretty else self._dumps(obj)
+
+    def __repr__(self):
+        return f'Codec({self.name})'
+
+
+def _json_loads(data):
+    return json.loads(bytes(data) if isinstance(data, memoryview) else data)
+
+
+def _stdlib() -> Codec:
+    return Codec('json', _json_loads,
+                 lambda obj: json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+                 lambda obj: json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8'))
+
+
+def _orjson() -> Codec:
+    import orjson
+    return Codec('orjson', orjson.loads, orjson.dumps, lambda obj: orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+
+
+def _msgspec() -> Codec:
+    import msgspec
+    decoder, encoder = msgspec.json.Decoder(), msgspec.json.Encoder()
+    return Codec('msgspec', decoder.decode, encoder.encode,
+                 lambda obj: msgspec.json.format(encoder.encode(obj), indent=2))
+
+
+def _ujson() -> Codec:
+    import ujson
+
+    def loads(data):
+        return ujson.loads(bytes(data) if isinstance(data, memoryview) else data)
+
+    return Codec('ujson', loads, lambda obj: ujson.dumps(obj, ensure_ascii=False).encode('utf-8'),
+                 lambda obj: ujson.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8'))
+
+
+CODECS = {'orjson': _orjson, 'msgspec': _msgspec, 'ujson': _ujson, 'json': _stdlib}
+_codecs = {}
+
+
+def available() -> list:
+    """
+    已安装的编解码器名称, 按PREFERENCE排序
+    """
+    names = []
+    for name in PREFERENCE:
+        try:
+            get_codec(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_codec(codec=None) -> Codec:
+    """
+    :param codec: 编解码器名称(见CODECS)或Codec对象, 不填则按PREFERENCE选择第一个已安装的
+    :return: Codec对象, 同名的编解码器只创建一次
+    """
+    if isinstance(codec, Codec):
+        return codec
+    if codec is None:
+        for name in PREFERENCE:
+            try:
+                return get_codec(name)
+            except ImportError:
+                continue
+    if codec not in CODECS:
+        raise ValueError(f'未知JSON编解码器: {codec}, 可选: {tuple(CODECS)}')
+    if codec not in _codecs:
+        _codecs[codec] = CODECS[codec]()
+    return _codecs[codec]
@@ -1,99 +1,222 @@
 import asyncio
-import json
+import re
 import zlib
-import queue
 from traceback import print_exc
 from functools import wraps
-from time import sleep
-from threading import Thread
-from typing import Callable, Any
-from struct import pack, unpack
-from collections import defaultdict
+from time import time, sleep, perf_counter, monotonic
+from random import uniform
+from threading import Thread, Lock, Event
+from typing import Callable, Any, Iterator, Iterable, Union
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from struct import pack, Struct
 
 import websocket
+import aiohttp
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 from .log import Log, void_loger
+from .pool import MessagePool
+from .dedup import Deduplicator
+from .filters import compile_filter, Gated
+from .keywords import KeywordIndex, KeywordDispatch, KeywordHit, KEYWORD_CMDS
+from .coalesce import Coalescer, Coalesced
+from .metrics import Metrics
+from .codec import Codec, get_codec
 from .messages import *
 
 
+HEADER = Struct('>IHHII')
+HEART_BEAT = Struct('>I')
+PROTOVER = 2 if brotli is None else 3
+CMD_PATTERN = re.compile(rb'"cmd"\s*:\s*"([^"]*)"')
+STALL_ERRORS = (TimeoutError, asyncio.TimeoutError, websocket.WebSocketTimeoutException)
+
+
 class Header:
     """
     数据头, 提供简单的解析方法
     """
-    INDEX = (4, 6, 8, 12, 16)
+    __slots__ = ('fields',)
     NAMES = ('总长度', '头部长度', '协议', '操作码', 'sequence')
 
-    def __init__(self, header: bytes):
-        if len(header) < 16:
-            raise ValueError(f'文件头长度不足16位，当前长度：{len(header)}，内容：{header}')
-        self.header_list = [header[0 if e == 0 else self.INDEX[e - 1]: i] for e, i in enumerate(self.INDEX)]
+    def __init__(self, header: bytes, offset: int = 0):
+        if len(header) - offset < 16:
+            raise ValueError(f'文件头长度不足16位，当前长度：{len(header) - offset}，内容：{bytes(header)}')
+        self.fields = HEADER.unpack_from(header, offset)
 
     def __getitem__(self, item: int) -> int:
-        temp = self.header_list[item]
-        return unpack('>i' if len(temp) == 4 else '>h', temp)[0]
+        return self.fields[item]
 
     def __str__(self):
-        string_list = []
-        for i in range(5):
-            if i in (0, 3, 4):
-                string_list.append(f'{self.NAMES[i]}:{unpack(">i", self.header_list[i])[0]}')
-            else:
-                string_list.append(f'{self.NAMES[i]}:{unpack(">h", self.header_list[i])[0]}')
-        return ', '.join(string_list)
+        return ', '.join(f'{name}:{value}' for name, value in zip(self.NAMES, self.fields))
+
+
+_shared_loop = None
+_shared_loop_lock = Lock()
+
+
+def shared_loop() -> asyncio.AbstractEventLoop:
+    """
+    获取进程内共享的事件循环, 首次调用时在后台线程中启动
+    """
+    global _shared_loop
+    with _shared_loop_lock:
+        if _shared_loop is None:
+            _shared_loop = asyncio.new_event_loop()
+            Thread(target=_shared_loop.run_forever, daemon=True).start()
+        return _shared_loop
 
 
-class LiveMessage:
+class BaseLiveMessage:
+    """
+    直播间连接基类, 提供与传输方式无关的编解码方法
+    """
+    URL = "ws://broadcastlv.chat.bilibili.com:2244/sub"
+    HEARTBEAT_INTERVAL = 30
+    HEARTBEAT_TIMEOUT = 70  # 超过该时长没有收到心跳包回复即认为连接已停滞
+    codec = get_codec()  # JSON编解码器, 可通过Live的codec参数为每个连接单独指定
 
     def __init__(self, room_id, logger: Log):
         self.room_id = room_id
         self.logger = logger
-        self.webs = websocket.create_connection("ws://broadcastlv.chat.bilibili.com:2244/sub")
         self.sequence = 0
+        self.last_heartbeat = monotonic()  # 最近一次收到心跳包回复的时间
+        self.recorder = None  # 设置为src.replay.FrameRecorder对象后, 收到的每一帧原始数据都会被记录
+        self.metrics = None  # 由src.metrics.Metrics.attach设置
 
-    def encode(self, msg: str, operation_code: int) -> bytes:
+    def encode(self, msg: Union[str, bytes], operation_code: int) -> bytes:
         """
         为消息添加消息头并编码为二进制
         :param msg: 消息内容
         :param operation_code: 操作码  2:心跳包  3:心跳包回复  5:普通包  7:认证包  8:认证包回复
         :return: 编码好的传递内容
         """
-        data = msg.encode('utf-8')
+        data = msg if isinstance(msg, bytes) else msg.encode('utf-8')
         packet_len = pack('>i', 16 + len(data))
         return packet_len + b'\x00\x10\x00\x00' + pack('>i', operation_code) + pack('>i', self.sequence) + data
 
-    def decode_msg(self, message: bytes) -> list:
-        msg_list = []
-
-        def iterate_msg(msg: bytes):
-            header = Header(msg[:16])
-            if header[0] != len(msg):
-                iterate_msg(msg[:header[0]])
-                iterate_msg(msg[header[0]:])
+    def decode_msg(self, message: bytes) -> Iterator[tuple[int, memoryview]]:
+        """
+        循环解析一帧中拼接的所有数据包, 压缩包解压后就地展开
+        :param message: websocket收到的一帧二进制数据
+        :return: (操作码, 包体)的迭代器, 包体为指向原数据或解压数据的memoryview
+        """
+        stack = []
+        buffer, offset = memoryview(message), 0
+        while True:
+            end = len(buffer)
+            while offset + 16 <= end:
+                packet_len, header_len, protover, operation, _ = HEADER.unpack_from(buffer, offset)
+                if header_len < 16 or packet_len < header_len or offset + packet_len > end:
+                    self.logger.warn(f'数据包长度异常: {packet_len}, 消息头长度: {header_len}, 丢弃剩余数据')
+                    break
+                body = buffer[offset + header_len: offset + packet_len]
+                offset += packet_len
+                if operation != 5 or protover in (0, 1):
+                    yield operation, body
+                    continue
+                start = perf_counter()
+                if protover == 2:
+                    data = zlib.decompress(body)
+                elif protover == 3 and brotli is not None:
+                    data = brotli.decompress(body)
+                else:
+                    self.logger.warn(f'未知压缩方式: {protover}')
+                    continue
+                if self.metrics is not None:
+                    self.metrics.decompress.observe(perf_counter() - start)
+                stack.append((buffer, offset))
+                buffer, offset, end = memoryview(data), 0, len(data)
+            if not stack:
                 return
-            if header[3] == 3:
-                msg_list.append(b'\x00\x00\00\x00' + msg[4:16] + b'{"cmd":"HEART_BEAT_REPLY","data":'
-                                + bytes(str(unpack('>i', msg[16:])[0]), encoding='utf-8') + b'}')
-            elif header[3] == 5:
-                match header[2]:
-                    case 0:
-                        msg_list.append(msg)
-                    case 2:
-                        iterate_msg(zlib.decompress(msg[16:]))
-                    case _:
-                        self.logger.warn('未知压缩方式')
-            elif header[3] == 8:
-                msg_list.append(b'\x00\x00\x00\x00' + msg[4:16] + b'{"cmd":"AUTH_REPLY","data":' + msg[16:] + b'}')
-
-        iterate_msg(message)
+            buffer, offset = stack.pop()
+
+    def parse_msg(self, message: bytes) -> list:
+        loads = self.codec.loads
+        msg_list = []
+        for operation, body in self.decode_msg(message):
+            if operation == 5:
+                msg_list.append(loads(body))
+            elif operation == 3:
+                self.last_heartbeat = monotonic()
+                msg_list.append({'cmd': 'HEART_BEAT_REPLY', 'data': HEART_BEAT.unpack_from(body)[0]})
+            elif operation == 8:
+                msg_list.append({'cmd': 'AUTH_REPLY', 'data': loads(body)})
         return msg_list
 
+    def stalled(self) -> bool:
+        """
+        连接是否已停滞: 超过HEARTBEAT_TIMEOUT没有收到心跳包回复
+        """
+        return monotonic() - self.last_heartbeat > self.HEARTBEAT_TIMEOUT
+
+    @staticmethod
+    def peek_cmd(body: memoryview) -> str:
+        """
+        不解析JSON, 直接从包体开头提取cmd, 提取失败时返回None
+        """
+        match = CMD_PATTERN.search(body, 0, 256) or CMD_PATTERN.search(body)
+        return match.group(1).decode('utf-8') if match else None
+
+    def split_msg(self, message: bytes) -> list[tuple[str, Any]]:
+        """
+        拆分数据包但不解析JSON
+        :return: (cmd, 包体)列表, 普通包的包体为未解析的memoryview, 心跳包与认证包回复的包体为字典
+        """
+        loads = self.codec.loads
+        packet_list = []
+        for operation, body in self.decode_msg(message):
+            if operation == 5:
+                cmd = self.peek_cmd(body)
+                if cmd is None:
+                    msg = loads(body)
+                    packet_list.append((msg.get('cmd'), msg))
+                else:
+                    packet_list.append((cmd, body))
+            elif operation == 3:
+                self.last_heartbeat = monotonic()
+                packet_list.append(('HEART_BEAT_REPLY',
+                                    {'cmd': 'HEART_BEAT_REPLY', 'data': HEART_BEAT.unpack_from(body)[0]}))
+            elif operation == 8:
+                packet_list.append(('AUTH_REPLY', {'cmd': 'AUTH_REPLY', 'data': loads(body)}))
+        return packet_list
+
+    def load(self, body) -> dict:
+        """
+        解析split_msg返回的包体
+        """
+        return body if isinstance(body, dict) else self.codec.loads(body)
+
+
+class LiveMessage(BaseLiveMessage):
+    """
+    基于websocket-client的阻塞连接, 心跳包在独立线程中发送
+    """
+
+    def __init__(self, room_id, logger: Log):
+        super().__init__(room_id, logger)
+        self.webs = None
+        self._stopped = Event()
+        self.open()
+
+    def open(self):
+        """
+        建立websocket连接, 超过HEARTBEAT_TIMEOUT没有收到任何数据时recv抛出超时异常
+        """
+        self.webs = websocket.create_connection(self.URL, timeout=self.HEARTBEAT_TIMEOUT)
+        self._stopped = Event()
+
     def send_auth(self):
         """
         发送认证包
         """
         self.sequence += 1
-        message = json.dumps({'roomid': self.room_id})
-        self.logger.debug('[发送认证包]' + message)
+        message = self.codec.dumps({'roomid': self.room_id, 'protover': PROTOVER})
+        self.logger.debug('[发送认证包]' + message.decode('utf-8'))
         self.webs.send(self.encode(message, 7))
         result = self.webs.recv()
         self.logger.debug('[认证包回复]' + str(result[16:]))
@@ -101,161 +224,846 @@ class LiveMessage:
 
     def send_heartbeat(self):
         """
-        发送心跳包
+        发送心跳包, 连接关闭或发送失败时退出
         """
-        sleep(3)
+        webs, stopped = self.webs, self._stopped
+        if stopped.wait(3):
+            return
         while True:
             self.sequence += 1
             message = ''
             self.logger.debug('[发送心跳包]' + message)
-            self.webs.send(self.encode(message, 2))
-            sleep(30)
+            try:
+                webs.send(self.encode(message, 2))
+            except Exception as e:
+                self.logger.warn(f'房间 {self.room_id} 心跳包发送失败: {e}')
+                return
+            if stopped.wait(self.HEARTBEAT_INTERVAL):
+                return
 
     def connect(self) -> bool:
+        if self.webs is None:
+            self.open()
+        self.last_heartbeat = monotonic()
         if self.send_auth() == b'{"code":0}':
             Thread(target=self.send_heartbeat, daemon=True).start()
             return True
         else:
+            self.logger.error(f'房间 {self.room_id} 认证失败')
             return False
 
+    def reconnect(self) -> bool:
+        """
+        关闭旧连接, 重新建立连接并认证
+        """
+        self.close()
+        self.sequence = 0
+        return self.connect()
+
+    def close(self):
+        self._stopped.set()
+        if self.webs is not None:
+            try:
+                self.webs.close()
+            except Exception:
+                pass
+            self.webs = None
+
+    def recv_frame(self) -> bytes:
+        frame = self.webs.recv()
+        if not frame:
+            raise ConnectionError('连接已关闭')
+        if self.recorder is not None:
+            self.recorder.write(frame)
+        if self.metrics is not None:
+            self.metrics.observe_frame(frame)
+        return frame
+
     def recv_msg(self):
-        message = self.webs.recv()
-        return [json.loads(str(msg[16:], encoding='utf-8')) for msg in self.decode_msg(message)]
+        return self.parse_msg(self.recv_frame())
+
+    def recv_packets(self):
+        return self.split_msg(self.recv_frame())
+
+
+class AsyncLiveMessage(BaseLiveMessage):
+    """
+    基于aiohttp的异步连接, 认证、心跳与接收均在同一事件循环中完成
+    """
 
+    def __init__(self, room_id, logger: Log, session: aiohttp.ClientSession = None):
+        super().__init__(room_id, logger)
+        self.webs = None
+        self.session = session
+        self._own_session = session is None
+        self._heartbeat_task = None
 
-class Live:
-    def __init__(self, room_id: int, logger: Log = void_loger):
+    def use_session(self, session: aiohttp.ClientSession):
+        """
+        使用外部的ClientSession, 关闭连接时不会关闭该会话
+        """
+        self.session = session
+        self._own_session = False
+
+    async def send_auth(self):
+        """
+        发送认证包
+        """
+        self.sequence += 1
+        message = self.codec.dumps({'roomid': self.room_id, 'protover': PROTOVER})
+        self.logger.debug('[发送认证包]' + message.decode('utf-8'))
+        await self.webs.send_bytes(self.encode(message, 7))
+        result = await self.webs.receive_bytes(timeout=self.HEARTBEAT_TIMEOUT)
+        self.logger.debug('[认证包回复]' + str(result[16:]))
+        return result[16:]
+
+    async def send_heartbeat(self):
+        """
+        发送心跳包, 发送失败时退出
+        """
+        webs = self.webs
+        await asyncio.sleep(3)
+        while True:
+            self.sequence += 1
+            message = ''
+            self.logger.debug('[发送心跳包]' + message)
+            try:
+                await webs.send_bytes(self.encode(message, 2))
+            except Exception as e:
+                self.logger.warn(f'房间 {self.room_id} 心跳包发送失败: {e}')
+                return
+            await asyncio.sleep(self.HEARTBEAT_INTERVAL)
+
+    async def connect(self) -> bool:
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        self.webs = await self.session.ws_connect(self.URL)
+        self.last_heartbeat = monotonic()
+        if await self.send_auth() == b'{"code":0}':
+            self._heartbeat_task = asyncio.create_task(self.send_heartbeat())
+            return True
+        else:
+            self.logger.error(f'房间 {self.room_id} 认证失败')
+            return False
+
+    async def reconnect(self) -> bool:
+        """
+        关闭旧连接, 重新建立连接并认证, 复用原有的ClientSession
+        """
+        await self._close_ws()
+        self.sequence = 0
+        return await self.connect()
+
+    async def recv_frame(self) -> bytes:
+        msg = await self.webs.receive(timeout=self.HEARTBEAT_TIMEOUT)
+        if msg.type != aiohttp.WSMsgType.BINARY:
+            raise ConnectionError(f'连接已关闭: {msg.type.name}')
+        frame = msg.data
+        if self.recorder is not None:
+            self.recorder.write(frame)
+        if self.metrics is not None:
+            self.metrics.observe_frame(frame)
+        return frame
+
+    async def recv_msg(self):
+        return self.parse_msg(await self.recv_frame())
+
+    async def recv_packets(self):
+        return self.split_msg(await self.recv_frame())
+
+    async def _close_ws(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        if self.webs is not None:
+            await self.webs.close()
+            self.webs = None
+
+    async def close(self):
+        await self._close_ws()
+        if self._own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class BaseLive:
+    """
+    消息处理器的注册与分发, 由Live与LiveHub共用
+    """
+    EXECUTORS = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
+
+    def __init__(self, logger: Log = void_loger, asynchronous: bool = False, loop: asyncio.AbstractEventLoop = None,
+                 lazy_json: bool = False, executor: Union[str, Executor] = None, max_workers: int = None,
+                 metrics: Metrics = None):
         self.logger = logger
-        self.msg_pool = queue.Queue(500)
-        self._coroutines = defaultdict(list)
-        self.web = LiveMessage(room_id, logger)
-        self.logger.debug(f"=======任务开始，房间号:{room_id}=======")
+        self.asynchronous = asynchronous
+        self.loop = loop
+        self.lazy_json = lazy_json
+        self.executor = executor
+        self.max_workers = max_workers
+        self.metrics = metrics
+        self._executors = {}
+        self._coroutines = {}
+        self._dispatch = ({}, ())
+        self._tasks = set()
+        self.taps = []
+        self.keywords = KeywordIndex()
+        self._keyword_cmds = set()
 
-    def _run_crawler(self):
-        self.web.connect()
+    def _add_coroutine(self, cmd: str, coro):
+        self._coroutines.setdefault(cmd, []).append(coro)
+        self._rebuild_dispatch()
 
-        def put_to_pool():
-            while True:
-                msgs = self.web.recv_msg()
-                for msg in msgs:
-                    if self.msg_pool.not_full:
-                        self.msg_pool.put(msg, block=False)
+    def _rebuild_dispatch(self):
+        """
+        重建分发表, 在注册消息处理器时调用, 分发时只需一次字典查询
+        """
+        coroutines = self._coroutines
+        common = tuple(coroutines.get('', ()))
+        fallback = common or tuple(coroutines.get('UNREGISTERED', ()))
+        table = {cmd: tuple(coro_list) + common for cmd, coro_list in coroutines.items()
+                 if coro_list and cmd not in ('', 'UNREGISTERED')}
+        self._dispatch = (table, fallback)
 
-        Thread(target=put_to_pool, daemon=True).start()
+    def _coroutine_list(self, cmd: str) -> tuple:
+        table, fallback = self._dispatch
+        return table.get(cmd, fallback)
 
-    def _run_coroutine(self):
-        loop = asyncio.new_event_loop()
-        Thread(target=loop.run_forever, daemon=True).start()
+    def _has_handler(self, cmd: str) -> bool:
+        return bool(self.taps or self._coroutine_list(cmd))
 
-        def get_from_pool():
-            while True:
-                msg = self.msg_pool.get(block=True)
-                cmd = msg.get('cmd')
-                coro_list = self._coroutines[cmd] + self._coroutines[''] or self._coroutines['UNREGISTERED']
-                for coro in coro_list:
-                    asyncio.run_coroutine_threadsafe(coro(msg), loop)
+    def tap(self, func: Callable[[list], Any]):
+        """
+        注册批量回调, 每批消息在分发给消息处理器之前整批传入func, 如src.bus.Publisher.publish
+        func在事件循环中同步调用, 不能阻塞; 存在回调时lazy_json不再跳过任何包
+        """
+        self.taps.append(func)
+        self._rebuild_dispatch()
+        return func
 
-        Thread(target=get_from_pool, daemon=True).start()
+    def _dispatch_state(self, msg: dict):
+        for coro in self._coroutines.get('CONNECTION_STATE', ()):
+            job = coro(msg)
+            if job is not None:
+                self._create_task(job)
 
-    def run(self, block=True):
-        self._run_crawler()
-        self._run_coroutine()
-        while block and input() not in ('q', 'quit', 'exit'):
-            pass
-        return self
+    def _create_task(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _dispatch_batch(self, msgs: list):
+        """
+        在事件循环中为一批消息创建处理任务
+        """
+        for tap in self.taps:
+            tap(msgs)
+        table, fallback = self._dispatch
+        for msg in msgs:
+            for coro in table.get(msg.get('cmd'), fallback):
+                job = coro(msg)
+                if job is not None:
+                    self._create_task(job)
 
     def _error_report(self, func):
         @wraps(func)
         async def wrap(*args, **kwargs):
+            metrics = self.metrics
+            start = perf_counter() if metrics is not None else 0
             try:
-                return await func(*args, **kwargs)
+                result = await func(*args, **kwargs)
             except Exception as exc:
                 self.logger.error(f'{func} {repr(exc)}')
                 print_exc()
                 print()
+                if metrics is not None:
+                    metrics.observe_handler(func.__qualname__, perf_counter() - start, True)
+                return
+            if metrics is not None:
+                metrics.observe_handler(func.__qualname__, perf_counter() - start)
+            return result
 
         return wrap
 
-    def to_coroutine(self, func):
-        @wraps(func)
-        async def wrap(*args, **kwargs):
-            return func(*args, **kwargs)
+    def _get_executor(self, executor):
+        if executor is None:
+            executor = self.executor
+        if isinstance(executor, str):
+            if executor not in self._executors:
+                if executor not in self.EXECUTORS:
+                    raise ValueError(f'未知执行器: {executor}, 可选: {tuple(self.EXECUTORS)}')
+                self._executors[executor] = self.EXECUTORS[executor](self.max_workers)
+            return self._executors[executor]
+        return executor
 
+    def to_coroutine(self, func, executor: Union[str, Executor] = None):
+        """
+        将普通函数包装为协程, 若指定了执行器(或Live设置了默认执行器), 函数将在执行器中运行而不阻塞事件循环
+        """
         if asyncio.iscoroutinefunction(func):
             return func
-        else:
+        pool = self._get_executor(executor)
+        if pool is None:
+            @wraps(func)
+            async def wrap(*args):
+                return func(*args)
+
             self.logger.warn(f'{func} 请尽量使用异步函数')
-            return wrap
+        else:
+            @wraps(func)
+            async def wrap(*args):
+                return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+
+        return wrap
+
+    @staticmethod
+    def _restrict(func, limit: int = None, timeout: float = None, ordered: bool = False):
+        """
+        为消息处理器添加并发数限制、超时与按cmd保序
+        """
+        if timeout is not None:
+            inner = func
+
+            @wraps(inner)
+            async def func(msg: dict):
+                return await asyncio.wait_for(inner(msg), timeout)
+
+        if ordered:
+            locks = {}
+            inner_ordered = func
+
+            @wraps(inner_ordered)
+            async def func(msg: dict):
+                cmd = msg.get('cmd')
+                lock = locks.get(cmd)
+                if lock is None:
+                    lock = locks[cmd] = asyncio.Lock()
+                async with lock:
+                    return await inner_ordered(msg)
+
+        if limit is not None:
+            semaphore = asyncio.Semaphore(limit)
+            inner_limited = func
+
+            @wraps(inner_limited)
+            async def func(msg: dict):
+                async with semaphore:
+                    return await inner_limited(msg)
+
+        return func
+
+    def _add_handler(self, cmd: str, func, model: type = None, executor: Union[str, Executor] = None,
+                     limit: int = None, timeout: float = None, ordered: bool = False, **filters):
+        """
+        包装并注册消息处理器
+        :param cmd: 包的CMD
+        :param func: 消息处理器
+        :param model: 不为None时, 先将字典封装为该消息类再传入消息处理器
+        :param executor: 普通函数使用的执行器, 'thread'、'process'或Executor对象, 不填则使用Live的默认执行器
+        :param limit: 该消息处理器同时运行的最大数量
+        :param timeout: 单次运行的超时时间(秒), 超时后记录错误
+        :param ordered: 为True时同一cmd的消息按到达顺序依次处理
+        :param filters: 过滤条件uid、name、room、min_price、min_coin、min_medal_level, 见src.filters.compile_filter,
+                        在分发时判断, 不满足条件的消息不会为该处理器创建任务
+        :return: 注册到分发表中的协程函数
+        """
+        match = compile_filter(model or MESSAGES.get(cmd), getattr(self, 'room_id', None), logger=self.logger,
+                               **filters)
+        function = self.to_coroutine(func, executor)
+        if model is not None:
+            model_function = function
+
+            @wraps(func)
+            async def function(data: dict):
+                return await model_function(model(data))
+
+        handler = self._restrict(function, limit, timeout, ordered)
+        coro = self._error_report(handler)
+        self._add_coroutine(cmd, coro if match is None else Gated(match, coro))
+        return handler
 
-    def register(self, cmd: str = '') -> Callable[[Callable[[dict], Any]], Callable[[dict], Any]]:
+    def register(self, cmd: str = '', **options) -> Callable[[Callable[[dict], Any]], Callable[[dict], Any]]:
         """
         自定义CMD解析方法,不填为解析所有方法
         :param cmd: 包的CMD
+        :param options: executor、limit、timeout、ordered与过滤条件, 见BaseLive._add_handler
         """
 
         def set_decorators(func: Callable[[dict], Any]) -> Callable[[dict], Any]:
-            function = self.to_coroutine(func)
-            self._coroutines[cmd].append(self._error_report(function))
+            self._add_handler(cmd, func, **options)
             return func
 
         return set_decorators
 
-    def all(self, func: Callable[[dict], Any]):
-        function = self.to_coroutine(func)
-        self._coroutines[''].append(self._error_report(function))
+    def all(self, func: Callable[[dict], Any] = None, **options):
+        if func is None:
+            return lambda f: self.all(f, **options)
+        self._add_handler('', func, **options)
         return func
 
-    def unregistered(self, func: Callable[[dict], Any]):
-        function = self.to_coroutine(func)
-        self._coroutines['UNREGISTERED'].append(self._error_report(function))
+    def unregistered(self, func: Callable[[dict], Any] = None, **options):
+        if func is None:
+            return lambda f: self.unregistered(f, **options)
+        self._add_handler('UNREGISTERED', func, **options)
         return func
 
-    def heart_beat_reply(self, func: Callable[[HeartBeatReply], Any]):
-        function = self.to_coroutine(func)
+    def observe(self, cmd: str, func: Callable[[dict], Any]):
+        """
+        注册同步的观察函数, 分发时在事件循环中直接调用而不创建任务, 返回值被忽略, func必须足够快且不能阻塞
+        如src.analytics.Analytics
+        """
 
-        @wraps(func)
-        async def register_func(data: dict):
-            return await function(HeartBeatReply(data))
+        def observer(msg: dict):
+            try:
+                func(msg)
+            except Exception as exc:
+                self.logger.error(f'{func} {repr(exc)}')
+                print_exc()
 
-        self._coroutines['HEART_BEAT_REPLY'].append(self._error_report(register_func))
-        return register_func
+        self._add_coroutine(cmd, observer)
+        return func
 
-    def danmu_msg(self, func: Callable[[DanmuMsg], Any]):
-        function = self.to_coroutine(func)
+    def keyword(self, keywords: Iterable[str] = (), regex: Iterable[str] = (), func: Callable[[KeywordHit], Any] = None,
+                cmds: Iterable[str] = KEYWORD_CMDS, ignore_case: bool = False, executor: Union[str, Executor] = None,
+                limit: int = None, timeout: float = None, ordered: bool = False, **filters):
+        """
+        关键词订阅, 弹幕与醒目留言的文本中出现任一关键词或匹配任一正则表达式时调用目标协程, 传入KeywordHit对象
+        所有订阅共用一个自动机, 每条消息只扫描一次; 之后可通过live.keywords.add/remove随时修改关键词
+        :param keywords: 关键词
+        :param regex: 正则表达式
+        :param cmds: 扫描的cmd, 默认为弹幕与醒目留言
+        :param ignore_case: 是否忽略大小写
+        其余参数见BaseLive._add_handler
+        """
+        if func is None:
+            return lambda f: self.keyword(keywords, regex, f, cmds, ignore_case, executor, limit, timeout, ordered,
+                                          **filters)
+        match = compile_filter(None, getattr(self, 'room_id', None), logger=self.logger, **filters)
+        handler = self._restrict(self.to_coroutine(func, executor), limit, timeout, ordered)
+        if func not in self.keywords.subscriptions:
+            self.keywords.subscribe(func, self._error_report(handler), cmds, match)
+        self.keywords.add(func, keywords, regex, ignore_case)
+        for cmd in cmds:
+            if cmd not in self._keyword_cmds:
+                self._keyword_cmds.add(cmd)
+                self._add_coroutine(cmd, KeywordDispatch(self, self.keywords, cmd))
+        return func
 
-        @wraps(func)
-        async def register_func(data: dict):
-            return await function(DanmuMsg(data))
+    def coalesce(self, cmd: str, window: float = 1.0, func: Callable[[Coalesced], Any] = None,
+                 executor: Union[str, Executor] = None, limit: int = None, timeout: float = None,
+                 ordered: bool = False, **filters):
+        """
+        合并窗口内相同的消息, 目标协程每个窗口只收到一个Coalesced对象, 包含消息数、uid列表与首末时间
+        相同的判断方式见src.coalesce.RULES: 弹幕按内容, 礼物按连击ID, 其余cmd按消息的字符串形式
+        :param cmd: 包的CMD
+        :param window: 窗口长度(秒)
+        其余参数见BaseLive._add_handler, 过滤条件在合并之前判断
+        """
+        if func is None:
+            return lambda f: self.coalesce(cmd, window, f, executor, limit, timeout, ordered, **filters)
+        match = compile_filter(MESSAGES.get(cmd), getattr(self, 'room_id', None), logger=self.logger, **filters)
+        handler = self._restrict(self.to_coroutine(func, executor), limit, timeout, ordered)
+        self._add_coroutine(cmd, Coalescer(self, cmd, window, self._error_report(handler), match))
+        return func
 
-        self._coroutines['DANMU_MSG'].append(self._error_report(register_func))
-        return register_func
+    def _typed(self, cmd: str, model: type, func, options: dict):
+        if func is None:
+            return lambda f: self._typed(cmd, model, f, options)
+        self._add_handler(cmd, func, model, **options)
+        return func
 
-    def super_chat_message(self, func: Callable[[SuperChatMessage], Any]):
-        function = self.to_coroutine(func)
+    def message(self, cmd: str, func: Callable[[Message], Any] = None, **options):
+        """
+        按cmd注册类型化的消息处理器, 消息会被封装为MESSAGES中对应的消息类
+        """
+        return self._typed(cmd, MESSAGES[cmd], func, options)
 
-        @wraps(func)
-        async def register_func(data: dict):
-            return await function(SuperChatMessage(data))
 
-        self._coroutines['SUPER_CHAT_MESSAGE'].append(self._error_report(register_func))
-        return register_func
+class Live(BaseLive):
+    BATCH_SIZE = 256
+    BACKOFF_BASE = 1.0  # 重连退避的初始时间(秒)
+    BACKOFF_MAX = 60.0  # 重连退避的最长时间(秒)
 
-    def entry_effect(self, func: Callable[[EntryEffect], Any]):
-        function = self.to_coroutine(func)
+    CONNECTING = 'connecting'  # 首次连接
+    CONNECTED = 'connected'  # 连接并认证成功
+    AUTH_FAILED = 'auth_failed'  # 认证失败, 将退避后重试
+    DISCONNECTED = 'disconnected'  # 连接断开
+    STALLED = 'stalled'  # 超时未收到心跳包回复
+    RECONNECTING = 'reconnecting'  # 正在重连
+    FAILOVER = 'failover'  # 已切换到备用连接
+    STANDBY_READY = 'standby_ready'  # 备用连接已认证
+    STATES = (CONNECTING, CONNECTED, AUTH_FAILED, DISCONNECTED, STALLED, RECONNECTING, FAILOVER, STANDBY_READY)
 
-        @wraps(func)
-        async def register_func(data: dict):
-            return await function(EntryEffect(data))
+    def __init__(self, room_id: int, logger: Log = void_loger, asynchronous: bool = False,
+                 loop: asyncio.AbstractEventLoop = None, lazy_json: bool = False, msg_pool: MessagePool = None,
+                 executor: Union[str, Executor] = None, max_workers: int = None, web: BaseLiveMessage = None,
+                 metrics: Metrics = None, standby: bool = False, hedge: int = 1, codec: Union[str, Codec] = None):
+        """
+        :param room_id: 房间号
+        :param logger: 日志对象
+        :param asynchronous: 为True时使用AsyncLiveMessage, 连接与消息处理器均运行在同一事件循环中, 不再为每个房间创建线程
+        :param loop: asynchronous模式下使用的事件循环, 不填则使用进程内共享的事件循环
+        :param lazy_json: 为True时先从原始包体中提取cmd, 仅解析存在消息处理器的包, 同一条消息的字典由所有处理器共享
+        :param msg_pool: 非asynchronous模式下的消息池, 可配置容量、溢出策略与优先级通道, 不填则使用默认的MessagePool
+        :param executor: 普通函数消息处理器的默认执行器, 'thread'、'process'或Executor对象, 不填则直接在事件循环中运行
+        :param max_workers: executor为字符串时创建的线程池/进程池大小
+        :param web: 自定义的消息来源, 如src.replay.FrameReplay, 需与asynchronous模式匹配, 不填则连接直播间
+        :param metrics: 运行指标, 见src.metrics.Metrics
+        :param standby: 为True时额外保持一条已认证的备用连接, 当前连接断开或停滞时立即切换, 无需等待重连与认证
+        :param hedge: 同时连接同一房间的连接数, 大于1时每条消息以最先到达的一份为准, 重复的消息按原始包体去重
+        :param codec: JSON编解码器, 'orjson'、'msgspec'、'ujson'、'json'或src.codec.Codec对象, 不填则使用已安装的最快的一个
+        """
+        super().__init__(logger, asynchronous, loop, lazy_json, executor, max_workers, metrics)
+        self.room_id = room_id
+        self.msg_pool = MessagePool() if msg_pool is None else msg_pool
+        self._readers = set()
+        self._handler_loop = None
+        self._finished = None
+        self.use_standby = standby
+        self.standby_web = None
+        self.hedge = hedge
+        self.hedge_webs = []
+        self.dedup = Deduplicator() if hedge > 1 else None
+        self.state = None
+        self.reconnects = 0
+        if web is not None:
+            self.web = web
+        else:
+            self.web = AsyncLiveMessage(room_id, logger) if asynchronous else LiveMessage(room_id, logger)
+        if codec is not None:
+            self.web.codec = get_codec(codec)
+        if metrics is not None:
+            metrics.attach(self)
+        self.logger.debug(f"=======任务开始，房间号:{room_id}=======")
 
-        self._coroutines['ENTRY_EFFECT'].append(self._error_report(register_func))
-        return register_func
+    def _load_packets(self, packets: list) -> list:
+        """
+        丢弃没有消息处理器的包, 仅解析剩余的包
+        """
+        load = self.web.load
+        metrics = self.metrics
+        if metrics is None:
+            return [load(body) for cmd, body in packets if self._has_handler(cmd)]
+        msgs = []
+        for cmd, body in packets:
+            metrics.messages[cmd] += 1
+            if self._has_handler(cmd):
+                msgs.append(load(body))
+            else:
+                metrics.ignored[cmd] += 1
+        return msgs
 
-    def danmu_aggregation(self, func: Callable[[DanmuAggregation], Any]):
-        function = self.to_coroutine(func)
+    def _count_msgs(self, msgs: list) -> list:
+        if self.metrics is not None:
+            messages = self.metrics.messages
+            for msg in msgs:
+                messages[msg.get('cmd')] += 1
+        return msgs
+
+    def _backoff(self, attempt: int) -> float:
+        """
+        第attempt次重试前的等待时间, 指数增长并带有随机抖动, 避免大量房间同时重连
+        """
+        delay = min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** attempt)
+        return uniform(delay / 2, delay)
+
+    def _emit_state(self, state: str, error: BaseException = None, attempt: int = 0):
+        """
+        记录连接状态, 并分发给CONNECTION_STATE消息处理器
+        """
+        if state != self.STANDBY_READY:
+            self.state = state
+        text = f'房间 {self.room_id} 连接状态: {state}'
+        if error is not None:
+            self.logger.warn(f'{text} ({error!r})')
+        else:
+            self.logger.info(text)
+        if not self._coroutines.get('CONNECTION_STATE'):
+            return
+        msg = {'cmd': 'CONNECTION_STATE', 'room_id': self.room_id, 'state': state, 'attempt': attempt,
+               'error': None if error is None else repr(error), 'timestamp': time()}
+        if self.asynchronous:
+            self._dispatch_state(msg)
+        elif self._handler_loop is not None:
+            self._handler_loop.call_soon_threadsafe(self._dispatch_state, msg)
+
+    def _new_web(self):
+        web = type(self.web)(self.room_id, self.logger)
+        web.codec = self.web.codec
+        return web
+
+    def _promote(self, web):
+        """
+        当前连接失效时切换到备用连接
+        :return: 是否成功切换
+        """
+        standby = self.standby_web
+        if standby is None:
+            return False
+        self.standby_web = None
+        standby.recorder, standby.metrics = web.recorder, web.metrics
+        self.web = standby
+        self.reconnects += 1
+        self._emit_state(self.FAILOVER)
+        return True
+
+    def _connect_web(self, reconnect: bool = False):
+        """
+        阻塞直到当前连接认证成功, 失败时按指数退避重试
+        """
+        attempt = 0
+        web = self.web
+        while True:
+            retry = reconnect or attempt > 0
+            self._emit_state(self.RECONNECTING if retry else self.CONNECTING, attempt=attempt)
+            try:
+                if web.reconnect() if retry else web.connect():
+                    self._emit_state(self.CONNECTED)
+                    return
+                self._emit_state(self.AUTH_FAILED, attempt=attempt)
+            except Exception as e:
+                self._emit_state(self.DISCONNECTED, e, attempt)
+            sleep(self._backoff(attempt))
+            attempt += 1
+
+    def _ready(self, web, hedge: bool):
+        if hedge:
+            self.hedge_webs.append(web)
+            self.logger.info(f'房间 {self.room_id} 并行连接已认证')
+        else:
+            self.standby_web = web
+            self._emit_state(self.STANDBY_READY)
+
+    def _lost(self, web, error: BaseException) -> bool:
+        """
+        处理备用或并行连接的断开, 在后台重新准备一条同类连接
+        :return: 断开的连接是否为当前连接
+        """
+        if web is self.web:
+            return True
+        self.logger.warn(f'房间 {self.room_id} 备用连接断开: {error!r}')
+        if web in self.hedge_webs:
+            self.hedge_webs.remove(web)
+            self._prepare_web(hedge=True)
+        elif self.standby_web is web:
+            self.standby_web = None
+            self._prepare_web()
+        return False
+
+    def _load_unique(self, packets: list, web) -> list:
+        """
+        并行连接模式下去除重复的包后再解析
+        """
+        packets = self.dedup.filter(packets, web is self.web, web)
+        if self.lazy_json:
+            return self._load_packets(packets)
+        load = self.web.load
+        return self._count_msgs([load(body) for cmd, body in packets])
+
+    def _prepare_web(self, hedge: bool = False):
+        """
+        在后台线程中建立并认证备用连接或并行连接, 就绪后由同一线程持续读取, asynchronous模式下改为创建任务
+        """
+        if self.asynchronous:
+            self._start_reader(self._prepare_web_async(hedge))
+            return
+
+        def prepare():
+            attempt = 0
+            while True:
+                try:
+                    web = self._new_web()
+                    if web.connect():
+                        break
+                    web.close()
+                except Exception as e:
+                    self.logger.warn(f'房间 {self.room_id} 备用连接失败: {e!r}')
+                sleep(self._backoff(attempt))
+                attempt += 1
+            self._ready(web, hedge)
+            self._read(web)
+
+        Thread(target=prepare, daemon=True).start()
+
+    def _read(self, web):
+        """
+        一条连接的读取循环, 当前连接与并行连接的消息放入消息池, 备用连接的消息直接丢弃, 只用于保持连接与检测停滞
+        当前连接断开或停滞时切换到备用连接, 没有备用连接时重连
+        """
+        while True:
+            try:
+                if self.dedup is not None and (web is self.web or web in self.hedge_webs):
+                    msgs = self._load_unique(web.recv_packets(), web)
+                elif web is not self.web:
+                    web.recv_packets()
+                    msgs = ()
+                elif self.lazy_json:
+                    msgs = self._load_packets(web.recv_packets())
+                else:
+                    msgs = self._count_msgs(web.recv_msg())
+                if web.stalled():
+                    raise TimeoutError(f'{web.HEARTBEAT_TIMEOUT}秒内没有收到心跳包回复')
+            except EOFError:
+                self.logger.info(f'房间 {self.room_id} 回放结束')
+                return
+            except Exception as e:
+                web.close()
+                if not self._lost(web, e):
+                    return
+                self._emit_state(self.STALLED if isinstance(e, STALL_ERRORS) else self.DISCONNECTED, e)
+                if self._promote(web):
+                    self._prepare_web()
+                    return
+                self.reconnects += 1
+                self._connect_web(reconnect=True)
+                continue
+            for msg in msgs:
+                self.msg_pool.put(msg)
+
+    def _run_crawler(self):
+        def crawl():
+            self._connect_web()
+            if self.use_standby:
+                self._prepare_web()
+            for _ in range(self.hedge - 1):
+                self._prepare_web(hedge=True)
+            self._read(self.web)
+
+        Thread(target=crawl, daemon=True).start()
+
+    def _run_coroutine(self):
+        loop = self._handler_loop = asyncio.new_event_loop()
+        Thread(target=loop.run_forever, daemon=True).start()
+
+        def get_from_pool():
+            while True:
+                batch = self.msg_pool.get_batch(self.BATCH_SIZE)
+                loop.call_soon_threadsafe(self._dispatch_batch, batch)
+
+        Thread(target=get_from_pool, daemon=True).start()
+
+    async def _connect_web_async(self, reconnect: bool = False):
+        """
+        _connect_web的异步版本
+        """
+        attempt = 0
+        web = self.web
+        while True:
+            retry = reconnect or attempt > 0
+            self._emit_state(self.RECONNECTING if retry else self.CONNECTING, attempt=attempt)
+            try:
+                if await (web.reconnect() if retry else web.connect()):
+                    self._emit_state(self.CONNECTED)
+                    return
+                self._emit_state(self.AUTH_FAILED, attempt=attempt)
+            except Exception as e:
+                self._emit_state(self.DISCONNECTED, e, attempt)
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def _start_reader(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._readers.add(task)
+        task.add_done_callback(self._readers.discard)
+
+    async def _prepare_web_async(self, hedge: bool = False):
+        attempt = 0
+        while True:
+            web = self._new_web()
+            try:
+                if await web.connect():
+                    break
+            except Exception as e:
+                self.logger.warn(f'房间 {self.room_id} 备用连接失败: {e!r}')
+            await web.close()
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+        self._ready(web, hedge)
+        await self._read_async(web)
+
+    async def _read_async(self, web):
+        """
+        _read的异步版本, 当前连接与并行连接的消息直接在事件循环中分发
+        """
+        while True:
+            try:
+                if self.dedup is not None and (web is self.web or web in self.hedge_webs):
+                    msgs = self._load_unique(await web.recv_packets(), web)
+                elif web is not self.web:
+                    await web.recv_packets()
+                    msgs = ()
+                elif self.lazy_json:
+                    msgs = self._load_packets(await web.recv_packets())
+                else:
+                    msgs = self._count_msgs(await web.recv_msg())
+                if web.stalled():
+                    raise TimeoutError(f'{web.HEARTBEAT_TIMEOUT}秒内没有收到心跳包回复')
+            except EOFError:
+                self.logger.info(f'房间 {self.room_id} 回放结束')
+                self._finished.set()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if web is not self.web:
+                    await web.close()
+                    self._lost(web, e)
+                    return
+                self._emit_state(self.STALLED if isinstance(e, STALL_ERRORS) else self.DISCONNECTED, e)
+                if self._promote(web):
+                    await web.close()
+                    self._prepare_web()
+                    return
+                self.reconnects += 1
+                await self._connect_web_async(reconnect=True)
+                continue
+            if msgs:
+                self._dispatch_batch(msgs)
+
+    async def run_async(self):
+        """
+        在当前事件循环中连接直播间并分发消息, 断开时自动重连, 直到回放结束或被取消
+        """
+        self._finished = asyncio.Event()
+        try:
+            await self._connect_web_async()
+            if self.use_standby:
+                self._prepare_web()
+            for _ in range(self.hedge - 1):
+                self._prepare_web(hedge=True)
+            self._start_reader(self._read_async(self.web))
+            await self._finished.wait()
+        finally:
+            for task in list(self._readers):
+                task.cancel()
+            for web in [self.web, self.standby_web] + self.hedge_webs:
+                if web is not None:
+                    await web.close()
+
+    def run(self, block=True):
+        if self.asynchronous:
+            if self.loop is None:
+                self.loop = shared_loop()
+            asyncio.run_coroutine_threadsafe(self.run_async(), self.loop)
+        else:
+            self._run_coroutine()
+            self._run_crawler()
+        while block and input() not in ('q', 'quit', 'exit'):
+            pass
+        return self
+
+
+def _typed_decorator(cmd: str, model: type):
+    def decorator(self: BaseLive, func: Callable[[Message], Any] = None, **options):
+        return self._typed(cmd, model, func, options)
+
+    decorator.__name__ = decorator.__qualname__ = cmd.lower()
+    decorator.__doc__ = f"""
+        装饰器, 注册目标协程至{cmd}, 消息会被封装为{model.__name__}对象传递给目标协程
+        :param options: executor、limit、timeout、ordered与过滤条件, 见BaseLive._add_handler
+        """
+    return decorator
 
-        @wraps(func)
-        async def register_func(data: dict):
-            return await function(DanmuAggregation(data))
 
-        self._coroutines['DANMU_AGGREGATION'].append(self._error_report(register_func))
-        return register_func
+for _cmd, _model in MESSAGES.items():
+    setattr(BaseLive, _cmd.lower(), _typed_decorator(_cmd, _model))
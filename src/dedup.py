@@ -0,0 +1,61 @@
+from time import monotonic
+from threading import Lock
+from collections import OrderedDict
+
+
+class Deduplicator:
+    """
+    带时间窗口与容量上限的指纹集合, 用于合并多条并行连接收到的同一条消息
+    指纹为原始包体的哈希, 包体中已包含cmd、uid、时间戳与内容, 无需解析JSON
+    只丢弃由其他连接先收到的包; 同一连接在窗口内重复收到的包(如数值未变化的ONLINE_RANK_COUNT)是真实的重复消息, 照常保留
+    """
+
+    def __init__(self, window: float = 10.0, maxsize: int = 100000):
+        """
+        :param window: 指纹保留的时间(秒), 应大于各连接之间的最大延迟差
+        :param maxsize: 最多保留的指纹数量, 超出时提前淘汰最早的指纹
+        """
+        self.window = window
+        self.maxsize = maxsize
+        self.duplicates = 0  # 被丢弃的重复包数量
+        self._seen = OrderedDict()  # 指纹 -> (过期时间, 首先收到该包的连接), 按最近收到的先后排列
+        self._lock = Lock()
+
+    def _expire(self, now: float):
+        seen = self._seen
+        while seen:
+            key = next(iter(seen))
+            if seen[key][0] > now and len(seen) < self.maxsize:
+                return
+            seen.popitem(last=False)
+
+    def filter(self, packets: list, primary: bool = True, source=None) -> list:
+        """
+        去除已从其他连接收到的包, 多个读取线程可同时调用
+        :param packets: BaseLiveMessage.split_msg返回的(cmd, 包体)列表
+        :param primary: 是否为主连接, 心跳包回复等已解析为字典的包只保留主连接的
+        :param source: 收到这些包的连接
+        """
+        now = monotonic()
+        expire_at = now + self.window
+        result = []
+        with self._lock:
+            self._expire(now)
+            seen = self._seen
+            for cmd, body in packets:
+                if isinstance(body, dict):
+                    if primary:
+                        result.append((cmd, body))
+                    continue
+                key = hash(body)
+                entry = seen.get(key)
+                if entry is not None and entry[1] is not source:
+                    self.duplicates += 1
+                    continue
+                seen[key] = (expire_at, source)
+                seen.move_to_end(key)
+                result.append((cmd, body))
+        return result
+
+    def __len__(self):
+        return len(self._seen)
@@ -0,0 +1,82 @@
+from typing import Callable, Iterable, Union
+
+from .log import BaseLog, void_loger
+from .messages import MESSAGES, Message
+
+FILTERS = ('uid', 'name', 'room', 'min_price', 'min_coin', 'min_medal_level')
+
+
+def _as_set(value, cast) -> frozenset:
+    if isinstance(value, (str, int)):
+        value = (value,)
+    return frozenset(cast(item) for item in value)
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def compile_filter(model: type = None, room_id: int = None, uid: Union[int, Iterable[int]] = None,
+                   name: Union[str, Iterable[str]] = None, room: Union[int, Iterable[int]] = None,
+                   min_price: float = None, min_coin: int = None, min_medal_level: int = None,
+                   logger: BaseLog = void_loger) -> Callable:
+    """
+    将声明式的过滤条件编译为一个判断函数, 字段通过消息类的惰性字段读取, 只访问用到的路径
+    :param model: 消息类, 不填则按每条消息的cmd从MESSAGES中查找
+    :param room_id: 消息中没有room_id时使用的房间号, 即单个Live的房间号
+    :param uid: 用户ID或用户ID集合
+    :param name: 用户名或用户名集合
+    :param room: 房间号或房间号集合
+    :param min_price: 最低价格(元), 按Message.coin计算
+    :param min_coin: 最低金瓜子数量
+    :param min_medal_level: 最低粉丝勋章等级
+    :param logger: 判断出错(如消息缺少字段)时记录错误, 该消息视为不满足条件
+    :return: 判断函数, 没有任何条件时返回None
+    """
+    checks = []
+    if room is not None:
+        rooms = _as_set(room, int)
+        checks.append(lambda msg, data: msg.get('room_id', room_id) in rooms)
+    if uid is not None:
+        uids = _as_set(uid, int)
+        checks.append(lambda msg, data: _to_int(getattr(data, 'uid', None)) in uids)
+    if name is not None:
+        names = _as_set(name, str)
+        checks.append(lambda msg, data: getattr(data, 'name', None) in names)
+    if min_medal_level is not None:
+        checks.append(lambda msg, data: (getattr(data, 'medal_level', None) or 0) >= min_medal_level)
+    if min_price is not None or min_coin is not None:
+        threshold = max(min_coin or 0, (min_price or 0) * 1000)
+        checks.append(lambda msg, data: (data.coin or 0) >= threshold)
+    if not checks:
+        return None
+
+    def match(msg: dict) -> bool:
+        try:
+            data = (model or MESSAGES.get(msg.get('cmd'), Message))(msg)
+            for check in checks:
+                if not check(msg, data):
+                    return False
+            return True
+        except Exception as exc:
+            logger.error(f'过滤条件判断失败, 丢弃消息 {msg.get("cmd")}: {repr(exc)}')
+            return False
+
+    return match
+
+
+class Gated:
+    """
+    带过滤条件的消息处理器, 不满足条件或判断出错时返回None, 分发时不会为其创建任务
+    """
+    __slots__ = ('match', 'func')
+
+    def __init__(self, match: Callable[[dict], bool], func):
+        self.match = match
+        self.func = func
+
+    def __call__(self, msg: dict):
+        return self.func(msg) if self.match(msg) else None
@@ -0,0 +1,121 @@
+import asyncio
+from typing import Union
+from concurrent.futures import Executor, Future
+
+import aiohttp
+
+from .log import Log, void_loger
+from .metrics import Metrics
+from .crawler import BaseLive, Live, AsyncLiveMessage, shared_loop
+
+
+class HubRoom(Live):
+    """
+    LiveHub中的单个房间, 自身不持有消息处理器, 收到的消息写入房间号后交给LiveHub分发
+    """
+
+    def __init__(self, hub: 'LiveHub', room_id: int, **options):
+        super().__init__(room_id, hub.logger, asynchronous=True, loop=hub.loop, lazy_json=hub.lazy_json,
+                         metrics=hub.metrics, **options)
+        self.hub = hub
+        self._coroutines = hub._coroutines
+
+    def _has_handler(self, cmd: str) -> bool:
+        return self.hub._has_handler(cmd)
+
+    def _dispatch_batch(self, msgs: list):
+        room_id = self.room_id
+        for msg in msgs:
+            msg['room_id'] = room_id
+        self.hub._dispatch_batch(msgs)
+
+    def _dispatch_state(self, msg: dict):
+        self.hub._dispatch_state(msg)
+
+
+class LiveHub(BaseLive):
+    """
+    在同一个事件循环中管理多个房间, 所有房间共用一套消息处理器与一个ClientSession
+    每条消息都带有room_id, 房间可以在运行中随时添加或移除
+    """
+
+    def __init__(self, logger: Log = void_loger, loop: asyncio.AbstractEventLoop = None, lazy_json: bool = False,
+                 executor: Union[str, Executor] = None, max_workers: int = None, metrics: Metrics = None,
+                 **room_options):
+        """
+        :param loop: 使用的事件循环, 不填则使用进程内共享的事件循环
+        :param room_options: 每个房间的默认参数, 如standby、hedge, 见Live.__init__
+        其余参数与Live.__init__相同
+        """
+        super().__init__(logger, True, loop, lazy_json, executor, max_workers, metrics)
+        self.room_options = room_options
+        self.rooms = {}
+        self.session = None
+        self._futures = {}
+        self._running = False
+
+    def add(self, room_id: int, **options) -> HubRoom:
+        """
+        添加房间, 已调用run时立即开始连接, 可在任意线程或消息处理器中调用
+        :param options: 覆盖该房间的默认参数
+        """
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = self.rooms[room_id] = HubRoom(self, room_id, **{**self.room_options, **options})
+            if self._running:
+                self._start(room)
+        return room
+
+    def remove(self, room_id: int) -> bool:
+        """
+        移除房间并关闭其连接
+        :return: 房间是否存在
+        """
+        room = self.rooms.pop(room_id, None)
+        if room is None:
+            return False
+        future = self._futures.pop(room_id, None)
+        if future is not None:
+            future.cancel()
+        if self.metrics is not None:
+            self.metrics.detach(room)
+        self.logger.info(f'房间 {room_id} 已移除')
+        return True
+
+    def _start(self, room: HubRoom):
+        self._futures[room.room_id] = asyncio.run_coroutine_threadsafe(self._run_room(room), self.loop)
+
+    async def _run_room(self, room: HubRoom):
+        if isinstance(room.web, AsyncLiveMessage) and room.web.session is None:
+            if self.session is None:
+                self.session = aiohttp.ClientSession()
+            room.web.use_session(self.session)
+        room.loop = self.loop
+        await room.run_async()
+
+    def run(self, block=True):
+        if self.loop is None:
+            self.loop = shared_loop()
+        self._running = True
+        for room in list(self.rooms.values()):
+            if room.room_id not in self._futures:
+                self._start(room)
+        while block and input() not in ('q', 'quit', 'exit'):
+            pass
+        return self
+
+    async def _close_session(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def close(self):
+        """
+        移除所有房间并关闭共用的ClientSession
+        """
+        for room_id in list(self.rooms):
+            self.remove(room_id)
+        self._running = False
+        if self.loop is not None:
+            future: Future = asyncio.run_coroutine_threadsafe(self._close_session(), self.loop)
+            future.result()
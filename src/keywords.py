@@ -0,0 +1,231 @@
+import re
+from collections import deque
+from typing import Callable, Iterable, Iterator
+
+from .messages import MESSAGES
+
+KEYWORD_CMDS = ('DANMU_MSG', 'SUPER_CHAT_MESSAGE', 'SUPER_CHAT_MESSAGE_JPN')
+
+
+class Automaton:
+    """
+    Aho-Corasick自动机, 一次扫描找出文本中出现的所有关键词
+    添加关键词时直接插入字典树, 失配指针在下一次扫描前按需重建
+    """
+
+    def __init__(self):
+        self.goto = [{}]  # 节点 -> {字符: 子节点}
+        self.own = [set()]  # 节点 -> 以该节点结尾的关键词
+        self.fail = [0]
+        self.outputs = [()]  # 节点 -> 沿失配指针可达的所有关键词
+        self._dirty = False
+
+    def add(self, word: str):
+        node = 0
+        for char in word:
+            child = self.goto[node].get(char)
+            if child is None:
+                child = len(self.goto)
+                self.goto[node][char] = child
+                self.goto.append({})
+                self.own.append(set())
+                self.fail.append(0)
+                self.outputs.append(())
+            node = child
+        self.own[node].add(word)
+        self._dirty = True
+
+    def discard(self, word: str):
+        """
+        移除关键词, 字典树中的节点保留, 只清除输出
+        """
+        node = 0
+        for char in word:
+            node = self.goto[node].get(char)
+            if node is None:
+                return
+        if word in self.own[node]:
+            self.own[node].discard(word)
+            self._dirty = True
+
+    def _build(self):
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        outputs[0] = tuple(self.own[0])
+        queue = deque()
+        for child in goto[0].values():
+            fail[child] = 0
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            outputs[node] = tuple(self.own[node]) + outputs[fail[node]]
+            for char, child in goto[node].items():
+                state = fail[node]
+                while char not in goto[state] and state:
+                    state = fail[state]
+                fail[child] = goto[state].get(char, 0)
+                queue.append(child)
+        self._dirty = False
+
+    def finditer(self, text: str) -> Iterator[tuple[str, int, int]]:
+        """
+        :return: (关键词, 起始位置, 结束位置)的迭代器, 结束位置不包含在匹配中
+        """
+        if self._dirty:
+            self._build()
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        node = 0
+        for index, char in enumerate(text):
+            while char not in goto[node] and node:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for word in outputs[node]:
+                yield word, index + 1 - len(word), index + 1
+
+
+class KeywordHit:
+    """
+    关键词订阅传递给消息处理器的对象
+    """
+    __slots__ = ('message', 'matches')
+
+    def __init__(self, message, matches: list):
+        self.message = message  # 消息类对象, 如DanmuMsg
+        self.matches = matches  # [(关键词或正则表达式, 起始位置, 结束位置), ...]
+
+    @property
+    def keywords(self) -> set:
+        return {pattern for pattern, start, end in self.matches}
+
+    def get(self, key, default=None):
+        """
+        与原始消息字典一致的get, 供按cmd保序等选项使用
+        """
+        return self.message.msg.get(key, default)
+
+    def __repr__(self):
+        return f'{self.message!r} 命中: {self.matches}'
+
+
+class _Subscription:
+    __slots__ = ('coro', 'cmds', 'match', 'keywords', 'regexes')
+
+    def __init__(self, coro, cmds: frozenset, match: Callable = None):
+        self.coro = coro
+        self.cmds = cmds
+        self.match = match
+        self.keywords = set()  # {(关键词, 是否忽略大小写)}
+        self.regexes = set()  # {(正则表达式, flags)}
+
+
+class KeywordIndex:
+    """
+    所有关键词订阅共用的索引, 每条消息只扫描一次, 再按命中的关键词找到对应的消息处理器
+    关键词使用Aho-Corasick自动机; 正则表达式无法合并进自动机, 每个不同的表达式每条消息各执行一次
+    """
+
+    def __init__(self):
+        self.automaton = Automaton()
+        self.automaton_ci = Automaton()  # 忽略大小写的关键词, 以小写形式保存
+        self.subscriptions = {}  # 用户的消息处理器 -> _Subscription
+        self._keywords = {}  # (关键词, 是否忽略大小写) -> {用户的消息处理器}
+        self._regexes = {}  # (正则表达式, flags) -> (编译后的表达式, {用户的消息处理器})
+
+    def subscribe(self, func, coro, cmds: Iterable[str], match: Callable = None):
+        self.subscriptions[func] = _Subscription(coro, frozenset(cmds), match)
+
+    def add(self, func, keywords: Iterable[str] = (), regex: Iterable[str] = (), ignore_case: bool = False):
+        """
+        为已订阅的消息处理器增加关键词与正则表达式
+        """
+        subscription = self.subscriptions[func]
+        for word in keywords:
+            key = (word.lower() if ignore_case else word, ignore_case)
+            if key not in self._keywords:
+                self._keywords[key] = set()
+                (self.automaton_ci if ignore_case else self.automaton).add(key[0])
+            self._keywords[key].add(func)
+            subscription.keywords.add(key)
+        flags = re.IGNORECASE if ignore_case else 0
+        for pattern in regex:
+            key = (pattern, flags)
+            if key not in self._regexes:
+                self._regexes[key] = (re.compile(pattern, flags), set())
+            self._regexes[key][1].add(func)
+            subscription.regexes.add(key)
+
+    def remove(self, func, keywords: Iterable[str] = None, regex: Iterable[str] = None, ignore_case: bool = False):
+        """
+        移除消息处理器的关键词与正则表达式, 均不填时取消该消息处理器的订阅
+        """
+        subscription = self.subscriptions.get(func)
+        if subscription is None:
+            return
+        if keywords is None and regex is None:
+            word_keys, regex_keys = set(subscription.keywords), set(subscription.regexes)
+            del self.subscriptions[func]
+        else:
+            flags = re.IGNORECASE if ignore_case else 0
+            word_keys = {(word.lower() if ignore_case else word, ignore_case) for word in keywords or ()}
+            regex_keys = {(pattern, flags) for pattern in regex or ()}
+        for key in word_keys:
+            subscription.keywords.discard(key)
+            funcs = self._keywords.get(key)
+            if funcs is not None:
+                funcs.discard(func)
+                if not funcs:
+                    del self._keywords[key]
+                    (self.automaton_ci if key[1] else self.automaton).discard(key[0])
+        for key in regex_keys:
+            subscription.regexes.discard(key)
+            entry = self._regexes.get(key)
+            if entry is not None:
+                entry[1].discard(func)
+                if not entry[1]:
+                    del self._regexes[key]
+
+    def scan(self, text: str) -> dict:
+        """
+        :return: 用户的消息处理器 -> [(关键词或正则表达式, 起始位置, 结束位置), ...]
+        """
+        hits = {}
+        keywords = self._keywords
+        for word, start, end in self.automaton.finditer(text):
+            for func in keywords[(word, False)]:
+                hits.setdefault(func, []).append((word, start, end))
+        if self.automaton_ci.goto[0]:
+            for word, start, end in self.automaton_ci.finditer(text.lower()):
+                for func in keywords[(word, True)]:
+                    hits.setdefault(func, []).append((word, start, end))
+        for (pattern, flags), (compiled, funcs) in self._regexes.items():
+            for found in compiled.finditer(text):
+                for func in funcs:
+                    hits.setdefault(func, []).append((pattern, found.start(), found.end()))
+        return hits
+
+
+class KeywordDispatch:
+    """
+    注册在KEYWORD_CMDS上的分发入口, 扫描消息文本后只为命中的消息处理器创建任务, 自身不创建任务
+    """
+    __slots__ = ('live', 'index', 'cmd', 'model')
+
+    def __init__(self, live, index: KeywordIndex, cmd: str):
+        self.live = live
+        self.index = index
+        self.cmd = cmd
+        self.model = MESSAGES[cmd]
+
+    def __call__(self, msg: dict):
+        data = self.model(msg)
+        text = data.message
+        if not text or not isinstance(text, str):
+            return None
+        subscriptions = self.index.subscriptions
+        for func, matches in self.index.scan(text).items():
+            subscription = subscriptions.get(func)
+            if subscription is None or self.cmd not in subscription.cmds:
+                continue
+            if subscription.match is not None and not subscription.match(msg):
+                continue
+            self.live._create_task(subscription.coro(KeywordHit(data, matches)))
+        return None
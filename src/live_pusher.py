@@ -1,108 +1,221 @@
-"""
-此文件不使用
-"""
 import asyncio
-import json
-import random
+from time import monotonic
+from random import uniform
+from typing import Callable
 
-import requests
+import aiohttp
 
-from log import BaseLog
+from .log import BaseLog, void_loger
+from .crawler import shared_loop
+
+
+class _Streamer:
+    __slots__ = ('uid', 'name', 'room_id', 'title', 'status', 'interval', 'next_poll')
+
+    def __init__(self, uid: int, interval: float):
+        self.uid = uid
+        self.name = str(uid)
+        self.room_id = None
+        self.title = ''
+        self.status = None  # None:尚未查询 0:未直播 1:直播中
+        self.interval = interval
+        self.next_poll = 0.0
 
 
 class LivePusher:
+    """
+    开播提醒, 批量查询多个用户的直播状态, 每个用户的查询间隔随状态变化自适应调整
+    状态不变时间隔逐渐增大到max_interval, 状态变化后恢复为min_interval; 被限流时暂停所有请求并指数退避
+    """
     REQUEST_HEADERS = {
-        "Referer": "https://www.bilibili.com",
+        "Referer": "https://live.bilibili.com",
         "User-Agent": "Mozilla/5.0"
     }
-
-    def __init__(self, logger: BaseLog, *uids: int):
-        self._uids: dict = {}
-        if uids is not None:
-            for uid_item in uids:
-                self._uids[uid_item] = 0
-        self._logger = logger
-
-    async def _request(self, method: str,
-                       url: str,
-                       params: dict = None) -> dict:
-        return json.loads(requests.request(
-            method=method,
-            url=url,
-            params=params,
-            headers=self.REQUEST_HEADERS).text)
-
-    async def __get_user_info(self, uid: int, func=None) -> dict:
-        data = (await self._request("GET", "https://api.bilibili.com/x/space/acc/info", {"mid": uid})
-                )["data"]
-        if func is not None:
-            func(data)
-        return data
-
-    async def __get_live_status(self, uid: int) -> int:
-        return (await self.__get_user_info(uid))["live_room"]["liveStatus"]
-
-    async def __pusher(self, func):
-        while True:
-            await asyncio.sleep(random.randint(3, 5))
-            for uid_item in self._uids:
-                live_status = await self.__get_live_status(uid_item)
-
-                def callback():
-                    func({
-                        "name": self._uids[uid_item]['name'],
-                        "uid": uid_item,
-                        "status": self._uids[uid_item]['status']
-                    }) if func else None
-
-                if live_status == 1:
-                    if self._uids[uid_item]["live_status"] == 0:
-                        self._uids[uid_item]["live_status"] = 1
-                        self._logger.info(f"开播提醒: {self._uids[uid_item]['name']} 开播了")
-                        callback()
-                else:
-                    if self._uids[uid_item]["live_status"] == 1:
-                        self._uids[uid_item]["live_status"] = 0
-                        self._logger.info(f"下播提醒: {self._uids[uid_item]['name']} 下播了")
-                        callback()
-
-    def run(self, callback=None):
+    BASE_URL = 'https://api.live.bilibili.com'
+    STATUS_PATH = '/room/v1/Room/get_status_info_by_uids'
+    BATCH_SIZE = 100  # 每个请求查询的最大用户数
+    RATE_LIMIT_STATUS = (412, 429)
+    RATE_LIMIT_CODES = (-412, -509, -799)
+
+    def __init__(self, logger: BaseLog = void_loger, *uids: int, base_url: str = BASE_URL, concurrency: int = 4,
+                 min_interval: float = 5.0, max_interval: float = 60.0, hub=None,
+                 loop: asyncio.AbstractEventLoop = None):
         """
-            func 回调会传出一个dict
-            dict = {
-                "name": up主名称
-                "uid": up主uid
-                "status": 直播间情况, 1为直播中， 0为未直播
-            }
+        :param uids: 需要提醒的用户uid
+        :param base_url: 接口地址, 测试时可指向本地的模拟服务
+        :param concurrency: 同时进行的最大请求数, 同时也是连接池的大小
+        :param min_interval: 每个用户的最短查询间隔(秒)
+        :param max_interval: 每个用户的最长查询间隔(秒)
+        :param hub: LiveHub或ShardedHub, 开播时自动添加直播间, 下播时移除
+        :param loop: run使用的事件循环, 不填则使用进程内共享的事件循环
         """
-        self._logger.info(
-            f"开播检测已挂载, 当前提醒的用户有: {' '.join(self._uids[uid_item]['name'] for uid_item in self._uids.keys())}")
-
-        async def gather(func):
-            await asyncio.gather(self.__pusher(func))
-
-        asyncio.run(gather(callback))
+        self._uids = {}
+        self._logger = logger
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.hub = hub
+        self.loop = loop
+        self.requests = 0
+        self._callback = None
+        self._session = None
+        self._semaphore = None
+        self._backoff = 0.0
+        self._blocked_until = 0.0
+        self._future = None
+        self.add(*uids)
 
     def add(self, *uids: int):
+        """
+        添加用户, 可在任意线程中调用, 下一次调度时查询
+        """
         for uid_item in uids:
             if uid_item not in self._uids:
-                asyncio.run(self.__add(uid_item))
-
-    async def __add(self, uid: int):
-        user_info = await self.__get_user_info(uid)
-        self._uids[uid] = \
-            {
-                "name": user_info["name"],
-                "live_status": user_info["live_room"]["liveStatus"]
-            }
-        self._logger.info(f"新增 {user_info['name']}({uid}) 开播提醒")
-        self._logger.info(f"现在 {user_info['name']}({uid}) 正在直播!") if \
-            self._uids[uid]["live_status"] == 1 else None
+                self._uids[uid_item] = _Streamer(uid_item, self.min_interval)
 
     def remove(self, *uids: int):
         for uid_item in uids:
             if uid_item not in self._uids:
                 self._logger.error(f"需要删除的uid: {uid_item}并不存在")
                 continue
-            self._logger.info(f"已删除 {self._uids[uid_item]['name']}({uid_item}) 的开播提醒")
-            self._uids.pop(uid_item)
+            streamer = self._uids.pop(uid_item)
+            self._logger.info(f"已删除 {streamer.name}({uid_item}) 的开播提醒")
+
+    def status(self, uid: int) -> dict:
+        streamer = self._uids[uid]
+        return {"name": streamer.name, "uid": uid, "status": streamer.status, "room_id": streamer.room_id,
+                "title": streamer.title}
+
+    def _rate_limited(self, retry_after: str = None):
+        self._backoff = min(self.max_interval, self._backoff * 2 or self.min_interval)
+        delay = float(retry_after) if retry_after and retry_after.isdigit() else self._backoff
+        self._blocked_until = monotonic() + delay * uniform(1, 1.2)
+        self._logger.warn(f'开播检测被限流, {delay:.1f}秒后重试')
+
+    async def _request(self, uids: list) -> dict:
+        """
+        :return: 接口返回的data, 被限流或请求失败时返回None
+        """
+        self.requests += 1
+        try:
+            async with self._session.post(self.base_url + self.STATUS_PATH, json={'uids': uids}) as response:
+                if response.status in self.RATE_LIMIT_STATUS:
+                    self._rate_limited(response.headers.get('Retry-After'))
+                    return None
+                result = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            self._logger.warn(f'开播检测请求失败: {e!r}')
+            return None
+        code = result.get('code')
+        if code in self.RATE_LIMIT_CODES:
+            self._rate_limited()
+            return None
+        if code != 0:
+            self._logger.warn(f'开播检测请求失败: {result.get("message")}({code})')
+            return None
+        self._backoff = 0.0
+        return result.get('data') or {}
+
+    async def _poll(self, batch: list):
+        async with self._semaphore:
+            if monotonic() < self._blocked_until:
+                return
+            data = await self._request([streamer.uid for streamer in batch])
+        now = monotonic()
+        for streamer in batch:
+            if data is None:
+                streamer.next_poll = max(now + self.min_interval, self._blocked_until)
+            else:
+                self._update(streamer, data.get(str(streamer.uid)), now)
+
+    def _update(self, streamer: _Streamer, info: dict, now: float):
+        if info is None:
+            streamer.interval = self.max_interval
+            streamer.next_poll = now + streamer.interval
+            return
+        status = 1 if info.get('live_status') == 1 else 0
+        streamer.name = info.get('uname') or streamer.name
+        streamer.room_id = info.get('room_id') or streamer.room_id
+        streamer.title = info.get('title') or streamer.title
+        previous, streamer.status = streamer.status, status
+        if previous is None:
+            self._logger.info(f"新增 {streamer.name}({streamer.uid}) 开播提醒")
+            if status == 1:
+                self._logger.info(f"现在 {streamer.name}({streamer.uid}) 正在直播!")
+                self._subscribe(streamer)
+        elif status != previous:
+            if status == 1:
+                self._logger.info(f"开播提醒: {streamer.name} 开播了")
+                self._subscribe(streamer)
+            else:
+                self._logger.info(f"下播提醒: {streamer.name} 下播了")
+                self._unsubscribe(streamer)
+            self._notify(streamer)
+        if previous is not None and status == previous:
+            streamer.interval = min(streamer.interval * 1.5, self.max_interval)
+        else:
+            streamer.interval = self.min_interval
+        streamer.next_poll = now + streamer.interval * uniform(0.9, 1.1)
+
+    def _subscribe(self, streamer: _Streamer):
+        if self.hub is not None and streamer.room_id:
+            self.hub.add(streamer.room_id)
+
+    def _unsubscribe(self, streamer: _Streamer):
+        if self.hub is not None and streamer.room_id:
+            self.hub.remove(streamer.room_id)
+
+    def _notify(self, streamer: _Streamer):
+        if self._callback is None:
+            return
+        result = self._callback(self.status(streamer.uid))
+        if asyncio.iscoroutine(result):
+            asyncio.get_running_loop().create_task(result)
+
+    def _due(self, now: float) -> list:
+        """
+        到期的用户, 同时捎带半个min_interval内即将到期的用户, 使请求尽量满载
+        """
+        horizon = now + self.min_interval / 2
+        streamers = sorted(self._uids.values(), key=lambda s: s.next_poll)
+        if not streamers or streamers[0].next_poll > now:
+            return []
+        return [streamer for streamer in streamers if streamer.next_poll <= horizon]
+
+    async def run_async(self, callback: Callable[[dict], None] = None):
+        """
+        :param callback: 开播或下播时调用, 可以是普通函数或异步函数, 传入status返回的字典:
+            {"name": up主名称, "uid": up主uid, "status": 1为直播中 0为未直播, "room_id": 房间号, "title": 直播标题}
+        """
+        self._callback = callback
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(headers=self.REQUEST_HEADERS, connector=connector) as session:
+            self._session = session
+            self._logger.info(f"开播检测已挂载, 当前提醒的用户有: {' '.join(map(str, self._uids))}")
+            while True:
+                now = monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                due = self._due(now)
+                if due:
+                    await asyncio.gather(*(self._poll(due[i:i + self.BATCH_SIZE])
+                                           for i in range(0, len(due), self.BATCH_SIZE)))
+                next_poll = min((streamer.next_poll for streamer in list(self._uids.values())),
+                                default=now + self.min_interval)
+                await asyncio.sleep(min(max(next_poll - monotonic(), 0.05), self.min_interval))
+
+    def run(self, callback: Callable[[dict], None] = None, block: bool = True):
+        if self.loop is None:
+            self.loop = shared_loop()
+        self._future = asyncio.run_coroutine_threadsafe(self.run_async(callback), self.loop)
+        if block:
+            self._future.result()
+        return self
+
+    def stop(self):
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
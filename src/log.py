@@ -1,31 +1,54 @@
 import os
+import sys
+import json
+import mmap
+import zlib
+from time import time
+from struct import Struct
+from bisect import bisect_left, bisect_right
 from datetime import datetime
-from typing import Union
+from traceback import print_exc
+from threading import Thread, Event
+from collections import deque
+from typing import Union, Iterable, Iterator, Callable
+
+from .messages import MESSAGES
+
+INDEX_ENTRY = Struct('>dQIqqI')  # 时间戳, 行偏移, 行长度, 房间号, uid, cmd的crc32
+UID_ENTRY = Struct('>qI')  # uid, 在.idx中的序号
+COVERAGE = Struct('>Q')  # .uid的文件头, 生成时.idx的条数
+LOG_CMD = 'LOG'
 
 log_objs = {}
 
 
 def get_log(path: str):
-    file_stat_dev = os.stat(path)
-    if file_stat_dev in log_objs:
-        return log_objs[file_stat_dev]
+    key = os.path.realpath(path)
+    if key in log_objs:
+        return log_objs[key]
     else:
         raise KeyError(f'路径 {path} 不存在Log对象')
 
 
 class BaseLog:
     def __init__(self, file_path: str, date_format='%H:%M:%S', file_mode='a'):
+        key = os.path.realpath(file_path)
+        if key in log_objs:
+            raise KeyError(f'以{file_path}为目标的Log对象已存在，如有需要可以使用get_log方法获取')
+        self.file_path = file_path
         self._file_io = open(file_path, file_mode, encoding='utf-8')
         self.date_format = date_format
-        file_stat_dev = os.stat(file_path).st_dev
-        if file_stat_dev not in log_objs:
-            log_objs[file_stat_dev] = self
-        else:
-            raise KeyError(f'以{file_path}为目标的Log对象已存在，如有需要可以使用get_log方法获取')
+        self._date_second = None
+        self._date_text = ''
+        log_objs[key] = self
 
     @property
     def _date(self):
-        return datetime.now().strftime(self.date_format)
+        second = int(time())
+        if second != self._date_second:
+            self._date_text = datetime.fromtimestamp(second).strftime(self.date_format)
+            self._date_second = second
+        return self._date_text
 
     def save(self, text: str, end='\n'):
         self._file_io.write(text + end)
@@ -45,47 +68,446 @@ class BaseLog:
 
     def close(self):
         self._file_io.close()
+        log_objs.pop(os.path.realpath(self.file_path), None)
 
 
 class Log(BaseLog):
     COLOR_TABLE = {'black': 30, 'red': 31, 'green': 32, 'yellow': 33, 'blue': 34, 'purple': 35, 'aqua': 36, 'white': 37,
                    True: 33, False: 0}
 
-    def __init__(self, file_path: str, color_print: bool = True, date_format: str = '%H:%M:%S', file_mode: str = 'a'):
+    def __init__(self, file_path: str, color_print: bool = True, date_format: str = '%H:%M:%S', file_mode: str = 'a',
+                 echo: bool = True):
+        """
+        :param echo: 是否同时输出到控制台
+        """
         super().__init__(file_path, date_format, file_mode)
         self.color_print = color_print
+        self.echo = echo
+
+    def print(self, text: str):
+        if self.echo:
+            print(text)
 
     def debug(self, text):
         date = self._date
         self.save(f'[{date}][DEBUG]{text}')
         if self.color_print:
-            print(f'\033[37m[{date}][DEBUG]{text}\033[0m')
+            self.print(f'\033[37m[{date}][DEBUG]{text}\033[0m')
         else:
-            print(f'[{date}][DEBUG]{text}')
+            self.print(f'[{date}][DEBUG]{text}')
 
     def info(self, text, mark: Union[bool, str] = False):
         date = self._date
         self.save(f'[{date}][INFO]{text}')
         if self.color_print:
-            print(f'\033[37m[{date}]\033[34m[INFO]\033[{self.COLOR_TABLE.get(mark, 0)}m{text}\033[0m')
+            self.print(f'\033[37m[{date}]\033[34m[INFO]\033[{self.COLOR_TABLE.get(mark, 0)}m{text}\033[0m')
         else:
-            print(f'[{date}][INFO]{text}')
+            self.print(f'[{date}][INFO]{text}')
 
     def warn(self, text):
         date = self._date
         self.save(f'[{date}][WARN]{text}')
         if self.color_print:
-            print(f'\033[37m[{date}]\033[1;33m[WARN]\033[0m{text}')
+            self.print(f'\033[37m[{date}]\033[1;33m[WARN]\033[0m{text}')
         else:
-            print(f'[{date}][WARN]{text}')
+            self.print(f'[{date}][WARN]{text}')
 
     def error(self, text):
         date = self._date
         self.save(f'[{date}][ERROR]{text}')
         if self.color_print:
-            print(f'\033[1;4;30;41m[{date}][ERROR]{text}\033[0m')
+            self.print(f'\033[1;4;30;41m[{date}][ERROR]{text}\033[0m')
         else:
-            print(f'[{date}][ERROR]{text}')
+            self.print(f'[{date}][ERROR]{text}')
+
+
+class BackgroundFlusher:
+    """
+    后台写入线程, 每隔interval秒或被wake唤醒时调用flush, 用于BufferedLog、StructuredLog、src.sink.Sink等先缓冲后批量写入的类
+    close时先等待线程退出再调用最后一次flush, 因此flush只会在同一时刻的一个线程中运行; flush出错时打印异常, 线程继续运行
+    """
+
+    def __init__(self, flush: Callable[[], None], interval: float):
+        self.flush = flush
+        self.interval = interval
+        self._wakeup = Event()
+        self._closed = False
+        self._thread = Thread(target=self._loop, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def wake(self):
+        """
+        立即唤醒后台线程写入, 可在任意线程调用
+        """
+        self._wakeup.set()
+
+    def _loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                print_exc()
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+
+
+class BufferedLog(Log):
+    """
+    缓冲日志, 记录先放入队列, 由后台线程按条数或时间批量写入, 并按大小或日期切分文件
+    """
+
+    def __init__(self, file_path: str, color_print: bool = True, date_format: str = '%H:%M:%S', file_mode: str = 'a',
+                 echo: bool = True, buffer_size: int = 1000, flush_interval: float = 1.0, max_bytes: int = 0,
+                 rotate_daily: bool = False):
+        """
+        :param buffer_size: 缓冲达到该条数时立即写入
+        :param flush_interval: 最长写入间隔(秒)
+        :param max_bytes: 单个文件的最大字节数, 超出后切分, 0为不按大小切分
+        :param rotate_daily: 是否在日期变化时切分文件
+        """
+        super().__init__(file_path, color_print, date_format, file_mode, echo)
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self._file_size = self._file_io.tell()
+        self._file_day = datetime.now().date()
+        self._lines = deque()
+        self._echo_lines = deque()
+        self._flusher = BackgroundFlusher(self.flush, flush_interval).start()
+
+    def save(self, text: str, end='\n'):
+        self._lines.append(text + end)
+        if len(self._lines) >= self.buffer_size:
+            self._flusher.wake()
+
+    def print(self, text: str):
+        if self.echo:
+            self._echo_lines.append(text + '\n')
+
+    def _rotate(self):
+        self._file_io.close()
+        if self.rotate_daily and datetime.now().date() != self._file_day:
+            suffix = self._file_day.isoformat()
+        else:
+            suffix = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        target, index = f'{self.file_path}.{suffix}', 1
+        while os.path.exists(target):
+            target, index = f'{self.file_path}.{suffix}.{index}', index + 1
+        os.rename(self.file_path, target)
+        self._file_io = open(self.file_path, 'a', encoding='utf-8')
+        self._file_size = 0
+        self._file_day = datetime.now().date()
+
+    def flush(self):
+        """
+        将缓冲中的记录写入文件与控制台, 由BackgroundFlusher调用
+        """
+        lines = self._lines
+        if lines:
+            if self.rotate_daily and datetime.now().date() != self._file_day:
+                self._rotate()
+            batch = [lines.popleft() for _ in range(len(lines))]
+            data = ''.join(batch)
+            self._file_io.write(data)
+            self._file_io.flush()
+            self._file_size += len(data.encode('utf-8'))
+            if self.max_bytes and self._file_size >= self.max_bytes:
+                self._rotate()
+        echo_lines = self._echo_lines
+        if echo_lines:
+            sys.stdout.write(''.join([echo_lines.popleft() for _ in range(len(echo_lines))]))
+            sys.stdout.flush()
+
+    def close(self):
+        self._flusher.close()
+        super().close()
+
+
+# noinspection PyMissingConstructor
+class StructuredLog(BaseLog):
+    """
+    结构化日志, 每条记录为一行JSON: {"t": 时间戳, "room": 房间号, "uid": uid, "msg": 消息}, 按日期写入directory/日期.jsonl
+    同时在日期.idx中追加定长索引(时间戳, 偏移, 长度, 房间号, uid, cmd的crc32), 日期切换或close时生成按uid排序的日期.uid
+    文本日志(debug/info/warn/error)记录为cmd为LOG的消息, 因此也可以作为Live的logger; 查询见LogReader
+    """
+
+    def __init__(self, directory: str = 'logs', buffer_size: int = 1000, flush_interval: float = 1.0):
+        """
+        :param directory: 日志目录
+        :param buffer_size: 缓冲达到该条数时立即写入
+        :param flush_interval: 最长写入间隔(秒)
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._file_io = None
+        self._index_io = None
+        self._offset = 0
+        self._day = None
+        self._date_cache = (None, '')
+        self._records = deque()
+        today = datetime.now().strftime('%Y-%m-%d')
+        for day in LogReader(directory).days():
+            if day < today:
+                self._seal(day)
+        self._flusher = BackgroundFlusher(self.flush, flush_interval).start()
+
+    def record(self, msg: dict, room_id=None, timestamp: float = None):
+        """
+        记录一条消息, 可在任意线程调用, 编码与写入在后台线程中进行
+        """
+        self._records.append((time() if timestamp is None else timestamp, msg.get('room_id', room_id), msg))
+        if len(self._records) >= self.buffer_size:
+            self._flusher.wake()
+
+    def attach(self, live, cmds: Iterable[str] = None):
+        """
+        记录Live或LiveHub的消息, 单个Live的消息使用其房间号
+        :param cmds: 记录的cmd, 通过Live.observe注册, lazy_json仍只解析这些cmd; 不填则通过Live.tap记录所有消息
+        """
+        room_id = getattr(live, 'room_id', None)
+        if cmds is not None:
+            for cmd in cmds:
+                live.observe(cmd, lambda msg, default=room_id: self.record(msg, default))
+            return self
+
+        def tap(batch: list):
+            now = time()
+            for msg in batch:
+                self.record(msg, room_id, now)
+
+        live.tap(tap)
+        return self
+
+    def save(self, text: str, end='\n'):
+        self._log('INFO', text)
+
+    def _log(self, level: str, text):
+        self._records.append((time(), None, {'cmd': LOG_CMD, 'level': level, 'text': str(text)}))
+
+    def debug(self, text):
+        self._log('DEBUG', text)
+
+    def info(self, text):
+        self._log('INFO', text)
+
+    def warn(self, text):
+        self._log('WARN', text)
+
+    def error(self, text):
+        self._log('ERROR', text)
+
+    def _path(self, day: str, suffix: str) -> str:
+        return os.path.join(self.directory, day + suffix)
+
+    def _day_of(self, timestamp: float) -> str:
+        second = int(timestamp)
+        if self._date_cache[0] != second:
+            self._date_cache = (second, datetime.fromtimestamp(second).strftime('%Y-%m-%d'))
+        return self._date_cache[1]
+
+    def _open(self, day: str):
+        self._close_day()
+        self._day = day
+        self._file_io = open(self._path(day, '.jsonl'), 'ab')
+        self._index_io = open(self._path(day, '.idx'), 'ab')
+        self._offset = self._file_io.tell()
+
+    def _close_day(self):
+        if self._day is not None:
+            self._file_io.close()
+            self._index_io.close()
+            self._seal(self._day)
+            self._day = None
+
+    def _seal(self, day: str):
+        """
+        生成按uid排序的索引, 文件头为已覆盖的索引条数, 之后追加的记录由LogReader顺序扫描
+        """
+        with open(self._path(day, '.idx'), 'rb') as f:
+            data = f.read()
+        count = len(data) // INDEX_ENTRY.size
+        if count == LogReader.uid_coverage(self._path(day, '.uid')):
+            return
+        entries = sorted((entry[4], number) for number, entry in enumerate(INDEX_ENTRY.iter_unpack(
+            data[:count * INDEX_ENTRY.size])) if entry[4])
+        temp_path = self._path(day, '.uid.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(COVERAGE.pack(count))
+            f.write(b''.join(UID_ENTRY.pack(uid_item, number) for uid_item, number in entries))
+        os.replace(temp_path, self._path(day, '.uid'))
+
+    def _write(self, lines: list, entries: list):
+        if lines:
+            self._file_io.write(b''.join(lines))
+            self._file_io.flush()
+            self._index_io.write(b''.join(entries))  # 数据先于索引落盘, 读取方看到的索引总是指向完整的行
+            self._index_io.flush()
+            lines.clear()
+            entries.clear()
+
+    def flush(self):
+        """
+        将缓冲中的记录写入文件, 由BackgroundFlusher调用
+        """
+        records = self._records
+        lines, entries = [], []
+        for _ in range(len(records)):
+            timestamp, room_id, msg = records.popleft()
+            day = self._day_of(timestamp)
+            if day != self._day:
+                self._write(lines, entries)
+                self._open(day)
+            cmd = msg.get('cmd', '')
+            uid_item = _uid(cmd, msg)
+            line = json.dumps({'t': timestamp, 'room': room_id, 'uid': uid_item, 'msg': msg},
+                              ensure_ascii=False).encode('utf-8') + b'\n'
+            entries.append(INDEX_ENTRY.pack(timestamp, self._offset, len(line), room_id or 0, uid_item,
+                                            zlib.crc32(cmd.encode('utf-8'))))
+            lines.append(line)
+            self._offset += len(line)
+        self._write(lines, entries)
+
+    def close(self):
+        self._flusher.close()
+        self._close_day()
+
+
+_uid_models = {}  # cmd -> 带uid字段的消息类或None
+
+
+def _uid(cmd: str, msg: dict) -> int:
+    if cmd not in _uid_models:
+        model = MESSAGES.get(cmd)
+        _uid_models[cmd] = model if model is not None and 'uid' in model.fields() else None
+    model = _uid_models[cmd]
+    if model is None:
+        return 0
+    try:
+        return int(model(msg).uid or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class _Column:
+    """
+    定长记录中某一列的只读序列视图, 用于在内存映射的索引上二分查找
+    """
+    __slots__ = ('buffer', 'struct', 'column', 'offset')
+
+    def __init__(self, buffer, struct: Struct, column: int, offset: int = 0):
+        self.buffer = buffer
+        self.struct = struct
+        self.column = column
+        self.offset = offset
+
+    def __len__(self):
+        return (len(self.buffer) - self.offset) // self.struct.size
+
+    def __getitem__(self, i: int):
+        return self.struct.unpack_from(self.buffer, self.offset + i * self.struct.size)[self.column]
+
+
+def _map(path: str):
+    try:
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):  # 文件不存在或为空
+        return None
+
+
+class LogReader:
+    """
+    查询StructuredLog的记录, 数据与索引均通过内存映射读取, 只解析命中的行
+    时间范围在索引上二分定位; 指定uid时使用按uid排序的索引; 房间号与cmd在时间范围内比较定长索引项
+    可以在StructuredLog写入的同时查询, 包括其他进程
+    """
+
+    def __init__(self, directory: str = 'logs'):
+        self.directory = directory
+
+    def days(self) -> list:
+        return sorted(name[:-4] for name in os.listdir(self.directory) if name.endswith('.idx'))
+
+    @staticmethod
+    def uid_coverage(path: str) -> int:
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(COVERAGE.size)
+        except FileNotFoundError:
+            return 0
+        return COVERAGE.unpack(header)[0] if len(header) == COVERAGE.size else 0
+
+    def query(self, start: float = None, end: float = None, room_id: int = None, uid: int = None, cmd: str = None,
+              limit: int = None) -> Iterator[dict]:
+        """
+        :param start: 起始时间戳
+        :param end: 结束时间戳(包含)
+        :param room_id: 房间号
+        :param uid: 用户uid
+        :param cmd: 消息的cmd, 文本日志为LOG
+        :param limit: 最多返回的条数
+        :return: 按时间顺序的记录, 格式见StructuredLog
+        """
+        first = None if start is None else datetime.fromtimestamp(start).strftime('%Y-%m-%d')
+        last = None if end is None else datetime.fromtimestamp(end).strftime('%Y-%m-%d')
+        count = 0
+        for day in self.days():
+            if first is not None and day < first or last is not None and day > last:
+                continue
+            for record in self._query_day(day, start, end, room_id, uid, cmd):
+                yield record
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+
+    def _query_day(self, day: str, start, end, room_id, uid, cmd) -> Iterator[dict]:
+        index = _map(os.path.join(self.directory, day + '.idx'))
+        if index is None:
+            return
+        data = _map(os.path.join(self.directory, day + '.jsonl'))  # 在索引之后映射, 保证覆盖索引中的所有行
+        uid_index = _map(os.path.join(self.directory, day + '.uid')) if uid is not None else None
+        crc = None if cmd is None else zlib.crc32(cmd.encode('utf-8'))
+        try:
+            count = len(index) // INDEX_ENTRY.size
+            if uid_index is not None:
+                covered = COVERAGE.unpack_from(uid_index)[0]
+                uids = _Column(uid_index, UID_ENTRY, 0, COVERAGE.size)
+                low, high = bisect_left(uids, uid), bisect_right(uids, uid)
+                numbers = [UID_ENTRY.unpack_from(uid_index, COVERAGE.size + i * UID_ENTRY.size)[1]
+                           for i in range(low, high)]
+                numbers.extend(range(covered, count))
+            else:
+                times = _Column(index, INDEX_ENTRY, 0)
+                low = 0 if start is None else bisect_left(times, start)
+                high = count if end is None else bisect_right(times, end)
+                numbers = range(low, high)
+            for number in numbers:
+                timestamp, offset, length, room, entry_uid, entry_crc = INDEX_ENTRY.unpack_from(
+                    index, number * INDEX_ENTRY.size)
+                if (start is not None and timestamp < start or end is not None and timestamp > end or
+                        room_id is not None and room != room_id or uid is not None and entry_uid != uid or
+                        crc is not None and entry_crc != crc):
+                    continue
+                record = json.loads(data[offset:offset + length])
+                if cmd is None or record['msg'].get('cmd') == cmd:
+                    yield record
+        finally:
+            for buffer in (index, data, uid_index):
+                if buffer is not None:
+                    buffer.close()
 
 
 # noinspection PyMissingConstructor
@@ -93,6 +515,8 @@ class VoidLog(BaseLog):
     def __init__(self):
         self._file_io = None
         self.date_format = ''
+        self._date_second = None
+        self._date_text = ''
 
     def debug(self, text: str):
         pass
@@ -1,30 +1,135 @@
-class HeartBeatReply:
+MESSAGES = {}  # cmd -> 消息类, 由Message.__init_subclass__自动注册
+
+
+class Field:
     """
-    心跳包回复（人气值）
+    惰性字段, 访问时才按路径从原始消息中取值, 不占用实例内存
+    """
+    __slots__ = ('path', 'default', 'type', 'name')
+
+    def __init__(self, *path, default=None, type=None):
+        """
+        :param path: 原始消息中的键/下标路径
+        :param default: 路径不存在时的默认值
+        :param type: 取值后的类型转换, 如部分cmd中uid为字符串
+        """
+        self.path = path
+        self.default = default
+        self.type = type
+        self.name = ''
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = instance.msg
+        try:
+            for key in self.path:
+                value = value[key]
+        except (KeyError, IndexError, TypeError):
+            return self.default
+        return value if self.type is None else self.type(value)
+
+
+class Message:
     """
+    消息基类, 仅保存原始消息字典, 字段在访问时才解析
+    继承时传入cmd参数即可注册到MESSAGES, 如: class DanmuMsg(Message, cmd='DANMU_MSG')
+    """
+    __slots__ = ('msg',)
+    CMD = ''
+    NAME = '消息'
+
+    room_id = Field('room_id')  # 由LiveHub等多房间工具写入的房间号
+
+    def __init_subclass__(cls, cmd: str = None, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cmd is not None:
+            cls.CMD = cmd
+            MESSAGES[cmd] = cls
 
     def __init__(self, msg: dict):
-        self.value = msg['data']
+        self.msg = msg
+
+    @classmethod
+    def fields(cls) -> tuple:
+        """
+        该消息类的所有惰性字段名
+        """
+        names = []
+        for klass in reversed(cls.__mro__):
+            names.extend(name for name, value in vars(klass).items()
+                         if isinstance(value, Field) and name != 'room_id' and name not in names)
+        return tuple(names)
+
+    @property
+    def coin(self) -> int:
+        """
+        该消息代表的金瓜子数量(1元 = 1000金瓜子), 非付费消息为0
+        """
+        return 0
 
     def __str__(self):
-        return f"人气值: {self.value}"
+        return ', '.join(f'{name}: {getattr(self, name)}' for name in self.fields())
 
     def __repr__(self):
-        return f"[心跳包回复]{self.__str__()}"
+        return f"[{self.NAME}]{self.__str__()}"
+
+
+class HeartBeatReply(Message, cmd='HEART_BEAT_REPLY'):
+    """
+    心跳包回复（人气值）
+    """
+    __slots__ = ()
+    NAME = '心跳包回复'
+
+    value: int = Field('data')
+
+    def __str__(self):
+        return f"人气值: {self.value}"
+
+
+class ConnectionState(Message, cmd='CONNECTION_STATE'):
+    """
+    连接状态变化, 由Live在连接、断开、重连与切换备用连接时产生, 不来自直播间
+    """
+    __slots__ = ()
+    NAME = '连接状态'
+
+    state: str = Field('state')  # 见Live.STATES
+    error: str = Field('error')  # 断开或认证失败的原因
+    attempt: int = Field('attempt', default=0)  # 当前为第几次重试
+    timestamp: float = Field('timestamp')
+
+    def __str__(self):
+        text = f"房间 {self.room_id}: {self.state}"
+        return f"{text} ({self.error})" if self.error else text
 
 
-class DanmuMsg:
+class DanmuMsg(Message, cmd='DANMU_MSG'):
     """
     弹幕
     """
+    __slots__ = ()
+    NAME = '弹幕'
 
-    def __init__(self, msg: dict):
-        data = msg["info"]
-        self.uid: int = data[2][0]
-        self.name: str = data[2][1]
-        self.message: str = data[1]
-        self.is_emotion: bool = 'url' in data[0][13]
-        self.emotion_pic: str = data[0][13]['url'] if self.is_emotion else ''
+    uid: int = Field('info', 2, 0)
+    name: str = Field('info', 2, 1)
+    message: str = Field('info', 1)
+    timestamp: int = Field('info', 0, 4)  # 毫秒
+    medal_level: int = Field('info', 3, 0, default=0)
+    medal_name: str = Field('info', 3, 1, default='')
+    user_level: int = Field('info', 4, 0, default=0)
+
+    @property
+    def is_emotion(self) -> bool:
+        return 'url' in self.msg['info'][0][13]
+
+    @property
+    def emotion_pic(self) -> str:
+        return self.msg['info'][0][13]['url'] if self.is_emotion else ''
 
     def __str__(self):
         if self.is_emotion:
@@ -32,40 +137,52 @@ class DanmuMsg:
         else:
             return f"{self.name}: {self.message}"
 
-    def __repr__(self):
-        return f"[弹幕]{self.__str__()}"
-
 
-class SuperChatMessage:
+class SuperChatMessage(Message, cmd='SUPER_CHAT_MESSAGE'):
     """
     醒目留言
     """
+    __slots__ = ()
+    NAME = '醒目留言'
+
+    sc_id: int = Field('data', 'id', type=int)
+    uid: int = Field('data', 'uid', type=int)  # 用户ID
+    name: str = Field('data', 'user_info', 'uname')  # 用户名
+    message: str = Field('data', 'message')  # 消息
+    face: str = Field('data', 'user_info', 'face')  # 头像链接
+    price: int = Field('data', 'price')  # 价格（SC打赏费用, 元）
+    medal_level: int = Field('data', 'medal_info', 'medal_level', default=0)
+    start_time: int = Field('data', 'start_time')
+    end_time: int = Field('data', 'end_time')
 
-    def __init__(self, msg: dict):
-        data = msg['data']
-        self.uid: int = data['uid']  # 用户ID
-        self.name: str = data['user_info']['uname']  # 用户名
-        self.message: str = data['message']  # 消息
-        self.face: str = data['user_info']['face']  # 头像链接
-        self.price: str = data['price']  # 价格（SC打赏费用）
+    @property
+    def coin(self) -> int:
+        return self.price * 1000
 
     def __str__(self):
         return f"{self.name}: [醒目留言] {self.message}"
 
-    def __repr__(self):
-        return f"[醒目留言]{self.__str__()}"
 
+class SuperChatMessageJpn(SuperChatMessage, cmd='SUPER_CHAT_MESSAGE_JPN'):
+    """
+    醒目留言（附日文翻译）
+    """
+    __slots__ = ()
+
+    message_jpn: str = Field('data', 'message_jpn')
 
-class EntryEffect:
+
+class EntryEffect(Message, cmd='ENTRY_EFFECT'):
     """
     舰长进入直播间提醒
     """
+    __slots__ = ()
+    NAME = '舰长入场'
 
-    def __init__(self, msg: dict):
-        data = msg['data']
-        self.uid: str = data['uid']
-        self.message: str = data['copy_writing']
-        self.face: str = data['face']
+    uid: int = Field('data', 'uid')
+    message: str = Field('data', 'copy_writing')
+    face: str = Field('data', 'face')
+    privilege_type: int = Field('data', 'privilege_type')
 
     @property
     def name(self) -> str:
@@ -76,68 +193,426 @@ class EntryEffect:
     def __str__(self):
         return f"{self.message.replace('<%', '【').replace('%>', '】')}"
 
-    def __repr__(self):
-        return f"[舰长入场]{self.__str__()}"
-
 
-class DanmuAggregation:
+class DanmuAggregation(Message, cmd='DANMU_AGGREGATION'):
     """
     集体弹幕,推测为出现过多相同弹幕时的优化,也可能只是单纯的抽奖弹幕
     """
+    __slots__ = ()
+    NAME = '集体弹幕'
 
-    def __init__(self, msg: dict):
-        data = msg['data']
-        self.message = data['msg']
-        self.aggregation_num = data['aggregation_num']
-        self.aggregation_icon = data['aggregation_icon']
+    message: str = Field('data', 'msg')
+    aggregation_num: int = Field('data', 'aggregation_num')
+    aggregation_icon: str = Field('data', 'aggregation_icon')
+    timestamp: int = Field('data', 'timestamp')
 
     def __str__(self):
         return f"{self.message} × {self.aggregation_num}"
 
-    def __repr__(self):
-        return f"[集体弹幕]{self.__str__()}"
 
+class GuardBuy(Message, cmd='GUARD_BUY'):
+    """
+    大航海购买
+    """
+    __slots__ = ()
+    NAME = '大航海'
 
-class GuardBuy:
-    def __init__(self, msg: dict):
-        data = msg['data']
-        self.name = data['username']
-        self.uid = data['uid']
-        self.gift = data['gift_name']
+    name: str = Field('data', 'username')
+    uid: int = Field('data', 'uid')
+    gift: str = Field('data', 'gift_name')
+    guard_level: int = Field('data', 'guard_level')  # 1:总督 2:提督 3:舰长
+    num: int = Field('data', 'num')
+    price: int = Field('data', 'price')  # 金瓜子
+    start_time: int = Field('data', 'start_time')
 
-        self.price = data['price']
+    @property
+    def coin(self) -> int:
+        return self.price
 
     def __str__(self):
         return f"{self.name} 成为了 {self.gift}"
 
-    def __repr__(self):
-        return f"[大航海]{self.__str__()}"
 
+class SendGift(Message, cmd='SEND_GIFT'):
+    """
+    礼物
+    """
+    __slots__ = ()
+    NAME = '礼物'
+
+    name: str = Field('data', 'uname')
+    uid: int = Field('data', 'uid')
+    gift: str = Field('data', 'giftName')
+    gift_id: int = Field('data', 'giftId')
+    gift_num: int = Field('data', 'num')
+    face: str = Field('data', 'face')
+    action: str = Field('data', 'action')
+    coin_type: str = Field('data', 'coin_type')  # gold:金瓜子 silver:银瓜子
+    total_coin: int = Field('data', 'total_coin')
+    medal_level: int = Field('data', 'medal_info', 'medal_level', default=0)
+    timestamp: int = Field('data', 'timestamp')
 
-class SendGift:
-    def __init__(self, msg: dict):
-        data = msg['data']
-        self.name = data['uname']
-        self.uid = data['uid']
-        self.gift = data['giftName']
-        self.gift_num = data['']
-        self.face = data['face']
-        self.action = data['action']
-        self.total_coin = data['combo_total_coin']
+    @property
+    def coin(self) -> int:
+        return self.total_coin if self.coin_type == 'gold' else 0
 
+    def __str__(self):
+        return f"{self.name} {self.action} {self.gift} × {self.gift_num}"
 
-class ComboSend:
-    def __init__(self, msg: dict):
-        data = msg['data']
-        self.name = data['uname']
-        self.uid = data['uid']
-        self.gift = data['gift_name']
-        self.gift_num = data['combo_num']
-        self.action = data['action']
-        self.total_coin = data['combo_total_coin']
+
+class ComboSend(Message, cmd='COMBO_SEND'):
+    """
+    连续礼物
+    """
+    __slots__ = ()
+    NAME = '连续礼物'
+
+    name: str = Field('data', 'uname')
+    uid: int = Field('data', 'uid')
+    gift: str = Field('data', 'gift_name')
+    gift_id: int = Field('data', 'gift_id')
+    gift_num: int = Field('data', 'combo_num')
+    action: str = Field('data', 'action')
+    combo_id: str = Field('data', 'combo_id')
+    total_coin: int = Field('data', 'combo_total_coin')
+    medal_level: int = Field('data', 'medal_info', 'medal_level', default=0)
 
     def __str__(self):
         return f"{self.name} {self.action} {self.gift} × {self.gift_num}"
 
-    def __repr__(self):
-        return f"[连续礼物]{self.__str__()}"
+
+class UserToastMsg(Message, cmd='USER_TOAST_MSG'):
+    """
+    开通大航海提示
+    """
+    __slots__ = ()
+    NAME = '大航海提示'
+
+    uid: int = Field('data', 'uid')
+    name: str = Field('data', 'username')
+    role_name: str = Field('data', 'role_name')
+    guard_level: int = Field('data', 'guard_level')
+    num: int = Field('data', 'num')
+    unit: str = Field('data', 'unit')
+    price: int = Field('data', 'price')  # 金瓜子
+    message: str = Field('data', 'toast_msg')
+
+    @property
+    def coin(self) -> int:
+        return self.price
+
+    def __str__(self):
+        return self.message.replace('<%', '').replace('%>', '')
+
+
+class InteractWord(Message, cmd='INTERACT_WORD'):
+    """
+    用户进入直播间或关注主播
+    """
+    __slots__ = ()
+    NAME = '互动'
+
+    uid: int = Field('data', 'uid')
+    name: str = Field('data', 'uname')
+    msg_type: int = Field('data', 'msg_type')  # 1:进入 2:关注 3:分享
+    medal_level: int = Field('data', 'fans_medal', 'medal_level', default=0)
+    timestamp: int = Field('data', 'timestamp')
+
+    def __str__(self):
+        action = {1: '进入直播间', 2: '关注了主播', 3: '分享了直播间'}.get(self.msg_type, f'互动({self.msg_type})')
+        return f"{self.name} {action}"
+
+
+class LikeInfoV3Click(Message, cmd='LIKE_INFO_V3_CLICK'):
+    """
+    点赞
+    """
+    __slots__ = ()
+    NAME = '点赞'
+
+    uid: int = Field('data', 'uid')
+    name: str = Field('data', 'uname')
+    like_text: str = Field('data', 'like_text')
+    medal_level: int = Field('data', 'fans_medal', 'medal_level', default=0)
+
+    def __str__(self):
+        return f"{self.name} {self.like_text}"
+
+
+class LikeInfoV3Update(Message, cmd='LIKE_INFO_V3_UPDATE'):
+    """
+    点赞数更新
+    """
+    __slots__ = ()
+    NAME = '点赞数'
+
+    click_count: int = Field('data', 'click_count')
+
+
+class OnlineRankCount(Message, cmd='ONLINE_RANK_COUNT'):
+    """
+    高能用户数量
+    """
+    __slots__ = ()
+    NAME = '高能用户数'
+
+    count: int = Field('data', 'count')
+
+
+class OnlineRankV2(Message, cmd='ONLINE_RANK_V2'):
+    """
+    高能榜
+    """
+    __slots__ = ()
+    NAME = '高能榜'
+
+    rank_list: list = Field('data', 'list', default=())
+    rank_type: str = Field('data', 'rank_type')
+
+
+class WatchedChange(Message, cmd='WATCHED_CHANGE'):
+    """
+    看过人数
+    """
+    __slots__ = ()
+    NAME = '看过人数'
+
+    num: int = Field('data', 'num')
+    text: str = Field('data', 'text_large')
+
+
+class RoomRealTimeMessageUpdate(Message, cmd='ROOM_REAL_TIME_MESSAGE_UPDATE'):
+    """
+    粉丝数更新
+    """
+    __slots__ = ()
+    NAME = '粉丝数'
+
+    fans: int = Field('data', 'fans')
+    fans_club: int = Field('data', 'fans_club')
+
+
+class StopLiveRoomList(Message, cmd='STOP_LIVE_ROOM_LIST'):
+    """
+    下播的直播间列表
+    """
+    __slots__ = ()
+    NAME = '下播列表'
+
+    room_id_list: list = Field('data', 'room_id_list', default=())
+
+
+class NoticeMsg(Message, cmd='NOTICE_MSG'):
+    """
+    全区广播/跑马灯
+    """
+    __slots__ = ()
+    NAME = '广播'
+
+    notice_id: int = Field('id')
+    title: str = Field('name')
+    message: str = Field('msg_self')
+    msg_type: int = Field('msg_type')
+    real_roomid: int = Field('real_roomid')
+
+    def __str__(self):
+        return self.message.replace('<%', '').replace('%>', '')
+
+
+class CommonNoticeDanmaku(Message, cmd='COMMON_NOTICE_DANMAKU'):
+    """
+    系统提示弹幕
+    """
+    __slots__ = ()
+    NAME = '系统提示'
+
+    content_segments: list = Field('data', 'content_segments', default=())
+
+    @property
+    def message(self) -> str:
+        return ''.join(segment.get('text', '') for segment in self.content_segments)
+
+    def __str__(self):
+        return self.message
+
+
+class AnchorLotCheckStatus(Message, cmd='ANCHOR_LOT_CHECKSTATUS'):
+    """
+    天选时刻审核状态
+    """
+    __slots__ = ()
+    NAME = '天选审核'
+
+    lot_id: int = Field('data', 'id')
+    status: int = Field('data', 'status')
+    uid: int = Field('data', 'uid')
+    reject_reason: str = Field('data', 'reject_reason')
+
+
+class GiftStarProcess(Message, cmd='GIFT_STAR_PROCESS'):
+    """
+    礼物星球进度
+    """
+    __slots__ = ()
+    NAME = '礼物星球'
+
+    status: int = Field('data', 'status')
+    tip: str = Field('data', 'tip')
+
+    def __str__(self):
+        return self.tip
+
+
+class HotRankChanged(Message, cmd='HOT_RANK_CHANGED'):
+    """
+    热门榜排名变化
+    """
+    __slots__ = ()
+    NAME = '热门榜'
+
+    rank: int = Field('data', 'rank')
+    trend: int = Field('data', 'trend')
+    countdown: int = Field('data', 'countdown')
+    area_name: str = Field('data', 'area_name')
+    timestamp: int = Field('data', 'timestamp')
+
+    def __str__(self):
+        return f"{self.area_name} 第{self.rank}名"
+
+
+class HotRankChangedV2(HotRankChanged, cmd='HOT_RANK_CHANGED_V2'):
+    __slots__ = ()
+
+
+class HotRankSettlement(Message, cmd='HOT_RANK_SETTLEMENT'):
+    """
+    热门榜结算
+    """
+    __slots__ = ()
+    NAME = '热门榜结算'
+
+    rank: int = Field('data', 'rank')
+    name: str = Field('data', 'uname')
+    area_name: str = Field('data', 'area_name')
+    message: str = Field('data', 'dm_msg')
+    timestamp: int = Field('data', 'timestamp')
+
+    def __str__(self):
+        return f"{self.name} {self.area_name} 第{self.rank}名"
+
+
+class HotRankSettlementV2(HotRankSettlement, cmd='HOT_RANK_SETTLEMENT_V2'):
+    __slots__ = ()
+
+
+class PkBattleStart(Message, cmd='PK_BATTLE_START'):
+    """
+    大乱斗开始
+    """
+    __slots__ = ()
+    NAME = '大乱斗开始'
+
+    pk_id: int = Field('pk_id')
+    pk_status: int = Field('pk_status')
+    timestamp: int = Field('timestamp')
+    start_time: int = Field('data', 'pk_start_time')
+    end_time: int = Field('data', 'pk_end_time')
+    init_room_id: int = Field('data', 'init_info', 'room_id')
+    match_room_id: int = Field('data', 'match_info', 'room_id')
+
+    def __str__(self):
+        return f"{self.init_room_id} VS {self.match_room_id}"
+
+
+class PkBattleStartNew(PkBattleStart, cmd='PK_BATTLE_START_NEW'):
+    __slots__ = ()
+
+
+class PkBattleProcess(Message, cmd='PK_BATTLE_PROCESS'):
+    """
+    大乱斗进程
+    """
+    __slots__ = ()
+    NAME = '大乱斗'
+
+    pk_id: int = Field('pk_id')
+    pk_status: int = Field('pk_status')
+    timestamp: int = Field('timestamp')
+    init_room_id: int = Field('data', 'init_info', 'room_id')
+    init_votes: int = Field('data', 'init_info', 'votes')
+    match_room_id: int = Field('data', 'match_info', 'room_id')
+    match_votes: int = Field('data', 'match_info', 'votes')
+
+    def __str__(self):
+        return f"{self.init_room_id}({self.init_votes}) VS {self.match_room_id}({self.match_votes})"
+
+
+class PkBattleProcessNew(PkBattleProcess, cmd='PK_BATTLE_PROCESS_NEW'):
+    __slots__ = ()
+
+
+class PopularityRedPocketStart(Message, cmd='POPULARITY_RED_POCKET_START'):
+    """
+    人气红包开始
+    """
+    __slots__ = ()
+    NAME = '红包开始'
+
+    lot_id: int = Field('data', 'lot_id')
+    uid: int = Field('data', 'sender_uid')
+    name: str = Field('data', 'sender_name')
+    message: str = Field('data', 'danmu')
+    start_time: int = Field('data', 'start_time')
+    end_time: int = Field('data', 'end_time')
+    total_price: int = Field('data', 'total_price')
+
+    def __str__(self):
+        return f"{self.name} 的红包: {self.message}"
+
+
+class PopularityRedPocketNew(Message, cmd='POPULARITY_RED_POCKET_NEW'):
+    """
+    送出人气红包
+    """
+    __slots__ = ()
+    NAME = '红包'
+
+    lot_id: int = Field('data', 'lot_id')
+    uid: int = Field('data', 'uid')
+    name: str = Field('data', 'uname')
+    action: str = Field('data', 'action')
+    gift: str = Field('data', 'gift_name')
+    num: int = Field('data', 'num')
+    price: int = Field('data', 'price')  # 金瓜子
+    medal_level: int = Field('data', 'medal_info', 'medal_level', default=0)
+
+    @property
+    def coin(self) -> int:
+        return self.price * self.num
+
+    def __str__(self):
+        return f"{self.name} {self.action} {self.gift} × {self.num}"
+
+
+class PopularityRedPocketWinnerList(Message, cmd='POPULARITY_RED_POCKET_WINNER_LIST'):
+    """
+    人气红包中奖名单
+    """
+    __slots__ = ()
+    NAME = '红包中奖'
+
+    lot_id: int = Field('data', 'lot_id')
+    total_num: int = Field('data', 'total_num')
+    winner_info: list = Field('data', 'winner_info', default=())  # [uid, 用户名, 奖励ID, 价值]
+    awards: dict = Field('data', 'awards', default={})
+
+
+class WidgetBanner(Message, cmd='WIDGET_BANNER'):
+    """
+    直播间挂件
+    """
+    __slots__ = ()
+    NAME = '挂件'
+
+    timestamp: int = Field('data', 'timestamp')
+    widget_list: dict = Field('data', 'widget_list', default={})
@@ -0,0 +1,179 @@
+from time import time
+from bisect import bisect_left
+from threading import Thread
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Histogram:
+    """
+    固定分桶的直方图, 记录耗时分布
+    """
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> dict:
+        cumulative, total = {}, 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            cumulative[bound] = total
+        return {'buckets': cumulative, 'sum': self.sum, 'count': self.count}
+
+
+class Metrics:
+    """
+    运行指标, 通过Live的metrics参数启用, 多个Live可共用一个对象
+    计数在各线程中直接累加而不加锁, 高并发下可能有极少量的计数误差
+    """
+
+    def __init__(self):
+        self.start_time = time()
+        self.frames = 0
+        self.bytes = 0
+        self.decompress = Histogram()
+        self.messages = Counter()  # 收到的消息, 按cmd
+        self.ignored = Counter()  # lazy_json模式下没有消息处理器而未解析的消息, 按cmd
+        self.handler_latency = {}  # 消息处理器名 -> Histogram
+        self.handler_errors = Counter()
+        self._lives = []
+        self._server = None
+
+    def attach(self, live):
+        """
+        由Live在初始化时调用, 队列长度与丢弃数量在生成快照时从Live的消息池中读取
+        """
+        live.web.metrics = self
+        self._lives.append(live)
+
+    def detach(self, live):
+        if live in self._lives:
+            self._lives.remove(live)
+
+    def observe_frame(self, frame: bytes):
+        self.frames += 1
+        self.bytes += len(frame)
+
+    def observe_handler(self, name: str, seconds: float, error: bool = False):
+        histogram = self.handler_latency.get(name)
+        if histogram is None:
+            histogram = self.handler_latency[name] = Histogram()
+        histogram.observe(seconds)
+        if error:
+            self.handler_errors[name] += 1
+
+    def snapshot(self) -> dict:
+        elapsed = max(time() - self.start_time, 1e-9)
+        rooms = {}
+        for live in self._lives:
+            pool = live.msg_pool
+            rooms[live.room_id] = {
+                'queue_depth': pool.qsize(),
+                'dropped': dict(getattr(pool, 'dropped', {})),
+                'pending_tasks': len(live._tasks),
+                'state': live.state,
+                'reconnects': live.reconnects,
+                'duplicates': 0 if live.dedup is None else live.dedup.duplicates,
+            }
+        return {
+            'uptime': elapsed,
+            'frames': self.frames,
+            'bytes': self.bytes,
+            'decompress': self.decompress.snapshot(),
+            'messages': dict(self.messages),
+            'message_rates': {cmd: count / elapsed for cmd, count in self.messages.items()},
+            'ignored': dict(self.ignored),
+            'rooms': rooms,
+            'handlers': {name: histogram.snapshot() for name, histogram in self.handler_latency.items()},
+            'handler_errors': dict(self.handler_errors),
+        }
+
+    def prometheus(self, prefix: str = 'bilive') -> str:
+        """
+        Prometheus文本格式的指标
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name: str, kind: str, samples: list):
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                lines.append(f'{prefix}_{name}{{{label_text}}} {value}' if label_text else f'{prefix}_{name} {value}')
+
+        def histogram(name: str, label: str, histograms: dict):
+            lines.append(f'# TYPE {prefix}_{name} histogram')
+            for key, data in histograms.items():
+                labels = f'{label}="{_escape(key)}",' if label else ''
+                for bound, count in data['buckets'].items():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{prefix}_{name}_bucket{{{labels}le="{le}"}} {count}')
+                suffix = f'{{{labels.rstrip(",")}}}' if labels else ''
+                lines.append(f'{prefix}_{name}_sum{suffix} {data["sum"]}')
+                lines.append(f'{prefix}_{name}_count{suffix} {data["count"]}')
+
+        metric('uptime_seconds', 'gauge', [({}, snapshot['uptime'])])
+        metric('frames_total', 'counter', [({}, snapshot['frames'])])
+        metric('received_bytes_total', 'counter', [({}, snapshot['bytes'])])
+        histogram('decompress_seconds', '', {'': snapshot['decompress']})
+        metric('messages_total', 'counter', [({'cmd': cmd}, n) for cmd, n in snapshot['messages'].items()])
+        metric('ignored_messages_total', 'counter', [({'cmd': cmd}, n) for cmd, n in snapshot['ignored'].items()])
+        metric('queue_depth', 'gauge', [({'room': room}, data['queue_depth']) for room, data in snapshot['rooms'].items()])
+        metric('pending_tasks', 'gauge',
+               [({'room': room}, data['pending_tasks']) for room, data in snapshot['rooms'].items()])
+        metric('connected', 'gauge', [({'room': room}, int(data['state'] in ('connected', 'failover')))
+                                      for room, data in snapshot['rooms'].items()])
+        metric('reconnects_total', 'counter',
+               [({'room': room}, data['reconnects']) for room, data in snapshot['rooms'].items()])
+        metric('duplicate_packets_total', 'counter',
+               [({'room': room}, data['duplicates']) for room, data in snapshot['rooms'].items()])
+        metric('dropped_messages_total', 'counter',
+               [({'room': room, 'cmd': cmd}, n) for room, data in snapshot['rooms'].items()
+                for cmd, n in data['dropped'].items()])
+        histogram('handler_seconds', 'handler', snapshot['handlers'])
+        metric('handler_errors_total', 'counter',
+               [({'handler': name}, n) for name, n in snapshot['handler_errors'].items()])
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int = 9108, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+        """
+        在后台线程中启动HTTP服务, 以Prometheus文本格式提供指标
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
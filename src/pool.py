@@ -0,0 +1,159 @@
+import os
+import json
+import queue
+from time import monotonic
+from threading import Condition
+from collections import deque, Counter
+
+
+class MessagePool:
+    """
+    带优先级通道与溢出策略的消息池, 用作Live.msg_pool
+    每个优先级通道有独立的容量, 低优先级通道被刷屏时不会挤占高优先级通道
+    """
+    DROP_OLDEST = 'drop_oldest'  # 丢弃通道中最早的消息
+    DROP_NEWEST = 'drop_newest'  # 丢弃新到的消息
+    BLOCK = 'block'  # 阻塞等待, 超时后丢弃新到的消息
+    SPILL = 'spill'  # 溢出的消息写入磁盘, 通道有空位时按顺序读回
+    POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK, SPILL)
+
+    DEFAULT_PRIORITY = {
+        'SUPER_CHAT_MESSAGE': 0,
+        'SUPER_CHAT_MESSAGE_JPN': 0,
+        'GUARD_BUY': 0,
+        'USER_TOAST_MSG': 0,
+        'SEND_GIFT': 0,
+    }
+    DEFAULT_LANE = 1
+
+    def __init__(self, maxsize: int = 500, policy: str = DROP_OLDEST, timeout: float = 1.0,
+                 priority: dict = None, spill_dir: str = 'spill'):
+        """
+        :param maxsize: 每个优先级通道的容量
+        :param policy: 溢出策略, 见MessagePool.POLICIES
+        :param timeout: BLOCK策略的最长等待时间(秒)
+        :param priority: cmd到优先级的映射, 数字越小越先被取出, 未列出的cmd优先级为DEFAULT_LANE
+        :param spill_dir: SPILL策略写入的目录
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f'未知溢出策略: {policy}, 可选: {self.POLICIES}')
+        self.maxsize = maxsize
+        self.policy = policy
+        self.timeout = timeout
+        self.priority = self.DEFAULT_PRIORITY if priority is None else priority
+        self.spill_dir = spill_dir
+        self.dropped = Counter()
+        self._lanes = {}
+        self._order = ()
+        self._spilled = Counter()
+        self._spill_readers = {}
+        self._size = 0
+        self._cond = Condition()
+
+    def _lane(self, lane: int) -> deque:
+        if lane not in self._lanes:
+            self._lanes[lane] = deque()
+            self._order = tuple(sorted(self._lanes))
+        return self._lanes[lane]
+
+    def _spill_path(self, lane: int) -> str:
+        return os.path.join(self.spill_dir, f'lane{lane}.jsonl')
+
+    def _spill(self, lane: int, msg: dict):
+        if not self._spilled[lane]:
+            os.makedirs(self.spill_dir, exist_ok=True)
+        with open(self._spill_path(lane), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(msg, ensure_ascii=False) + '\n')
+        self._spilled[lane] += 1
+
+    def _unspill(self, lane: int, messages: deque):
+        reader = self._spill_readers.get(lane)
+        if reader is None:
+            reader = self._spill_readers[lane] = open(self._spill_path(lane), 'r', encoding='utf-8')
+        while self._spilled[lane] and len(messages) < self.maxsize:
+            messages.append(json.loads(reader.readline()))
+            self._spilled[lane] -= 1
+            self._size += 1
+        if not self._spilled[lane]:
+            reader.close()
+            del self._spill_readers[lane]
+            os.remove(self._spill_path(lane))
+
+    def put(self, msg: dict, block: bool = True) -> bool:
+        """
+        放入一条消息, 通道已满时按溢出策略处理
+        :return: 消息是否进入消息池
+        """
+        cmd = msg.get('cmd')
+        lane = self.priority.get(cmd, self.DEFAULT_LANE)
+        with self._cond:
+            messages = self._lane(lane)
+            if self._spilled[lane]:
+                self._spill(lane, msg)
+                return True
+            if len(messages) >= self.maxsize:
+                if self.policy == self.DROP_OLDEST:
+                    dropped = messages.popleft()
+                    self._size -= 1
+                    self.dropped[dropped.get('cmd')] += 1
+                elif self.policy == self.SPILL:
+                    self._spill(lane, msg)
+                    return True
+                elif self.policy == self.BLOCK and block:
+                    deadline = monotonic() + self.timeout
+                    while len(messages) >= self.maxsize:
+                        remaining = deadline - monotonic()
+                        if remaining <= 0 or not self._cond.wait(remaining):
+                            break
+                if len(messages) >= self.maxsize:
+                    self.dropped[cmd] += 1
+                    return False
+            messages.append(msg)
+            self._size += 1
+            self._cond.notify_all()
+            return True
+
+    def _pop(self) -> dict:
+        for lane in self._order:
+            messages = self._lanes[lane]
+            if messages:
+                msg = messages.popleft()
+                self._size -= 1
+                if self._spilled[lane]:
+                    self._unspill(lane, messages)
+                return msg
+
+    def get(self, block: bool = True, timeout: float = None) -> dict:
+        """
+        按优先级取出一条消息, 无消息时行为与queue.Queue.get一致
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._size, timeout if block else 0):
+                raise queue.Empty
+            msg = self._pop()
+            self._cond.notify_all()
+            return msg
+
+    def get_nowait(self) -> dict:
+        return self.get(block=False)
+
+    def get_batch(self, max_size: int) -> list:
+        """
+        阻塞直到有消息, 然后按优先级一次性取出至多max_size条消息
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._size)
+            batch = []
+            while self._size and len(batch) < max_size:
+                batch.append(self._pop())
+            self._cond.notify_all()
+            return batch
+
+    def qsize(self) -> int:
+        return self._size
+
+    def lane_sizes(self) -> dict:
+        """
+        每个优先级通道的当前长度(不含已写入磁盘的消息)
+        """
+        return {lane: len(self._lanes[lane]) for lane in self._order}
@@ -0,0 +1,203 @@
+import zlib
+import asyncio
+from time import time, sleep, monotonic
+from bisect import bisect_right
+from struct import Struct
+from threading import Lock
+from typing import Iterator
+
+from .log import Log, void_loger
+from .crawler import BaseLiveMessage, LiveMessage, AsyncLiveMessage
+
+BLOCK = Struct('>II')  # 压缩后长度, 帧数
+RECORD = Struct('>dI')  # 接收时间戳, 帧长度
+INDEX = Struct('>dQ')  # 块内第一帧的时间戳, 块在数据文件中的偏移
+
+
+class FrameRecorder:
+    """
+    原始帧记录器, 以只追加的方式将帧分块压缩写入数据文件, 并在path + '.idx'中记录每块的时间索引
+    """
+
+    def __init__(self, path: str, block_frames: int = 256, block_interval: float = 5.0):
+        """
+        :param path: 数据文件路径, 已存在时继续追加
+        :param block_frames: 每块最多包含的帧数
+        :param block_interval: 每块最长的缓冲时间(秒)
+        """
+        self.path = path
+        self.block_frames = block_frames
+        self.block_interval = block_interval
+        self._data_io = open(path, 'ab')
+        self._index_io = open(path + '.idx', 'ab')
+        self._records = []
+        self._first_time = 0.0
+        self._lock = Lock()
+
+    def write(self, frame: bytes, timestamp: float = None):
+        timestamp = time() if timestamp is None else timestamp
+        with self._lock:
+            if not self._records:
+                self._first_time = timestamp
+            self._records.append(RECORD.pack(timestamp, len(frame)))
+            self._records.append(bytes(frame))
+            if len(self._records) >= self.block_frames * 2 or timestamp - self._first_time >= self.block_interval:
+                self._flush()
+
+    def _flush(self):
+        if not self._records:
+            return
+        data = zlib.compress(b''.join(self._records))
+        offset = self._data_io.tell()
+        self._data_io.write(BLOCK.pack(len(data), len(self._records) // 2) + data)
+        self._data_io.flush()
+        self._index_io.write(INDEX.pack(self._first_time, offset))
+        self._index_io.flush()
+        self._records.clear()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._data_io.close()
+            self._index_io.close()
+
+
+class FrameReader:
+    """
+    读取FrameRecorder记录的文件, 使用时间索引随机定位
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path + '.idx', 'rb') as f:
+            data = f.read()
+        entries = [INDEX.unpack_from(data, offset) for offset in range(0, len(data) - INDEX.size + 1, INDEX.size)]
+        self.times = [entry[0] for entry in entries]
+        self.offsets = [entry[1] for entry in entries]
+
+    def frames(self, start: float = None) -> Iterator[tuple[float, bytes]]:
+        """
+        :param start: 起始时间戳, 不填则从头读取
+        :return: (接收时间戳, 原始帧)的迭代器
+        """
+        block = 0 if start is None else max(bisect_right(self.times, start) - 1, 0)
+        if block >= len(self.offsets):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.offsets[block])
+            while True:
+                header = f.read(BLOCK.size)
+                if len(header) < BLOCK.size:
+                    return
+                length, count = BLOCK.unpack(header)
+                data = zlib.decompress(f.read(length))
+                offset = 0
+                for _ in range(count):
+                    timestamp, frame_len = RECORD.unpack_from(data, offset)
+                    offset += RECORD.size
+                    if start is None or timestamp >= start:
+                        yield timestamp, data[offset:offset + frame_len]
+                    offset += frame_len
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+class _Pacer:
+    """
+    按记录时的时间间隔(除以speed)计算每一帧需要等待的时间
+    """
+
+    def __init__(self, speed: float):
+        self.speed = speed
+        self._origin = None
+
+    def delay(self, timestamp: float) -> float:
+        if not self.speed:
+            return 0
+        now = monotonic()
+        if self._origin is None:
+            self._origin = (now, timestamp)
+            return 0
+        return self._origin[0] + (timestamp - self._origin[1]) / self.speed - now
+
+
+class FrameReplay(LiveMessage):
+    """
+    回放FrameRecorder记录的文件, 可作为Live的web参数代替websocket连接, 回放结束时recv_frame抛出EOFError
+    """
+
+    def __init__(self, path: str, logger: Log = void_loger, speed: float = 1.0, start: float = None, room_id=0):
+        """
+        :param path: FrameRecorder的数据文件路径
+        :param speed: 回放倍速, 0或None为不等待、尽可能快地回放
+        :param start: 起始时间戳, 使用索引直接定位
+        """
+        BaseLiveMessage.__init__(self, room_id, logger)  # 不调用LiveMessage.__init__, 避免建立websocket连接
+        self.reader = FrameReader(path)
+        self._frames = self.reader.frames(start)
+        self._pacer = _Pacer(speed)
+
+    def send_auth(self):
+        return b'{"code":0}'
+
+    def send_heartbeat(self):
+        pass
+
+    def connect(self) -> bool:
+        return True
+
+    def reconnect(self) -> bool:
+        """
+        回放时出错的帧直接跳过
+        """
+        return True
+
+    def close(self):
+        pass
+
+    def stalled(self) -> bool:
+        return False
+
+    def recv_frame(self) -> bytes:
+        for timestamp, frame in self._frames:
+            delay = self._pacer.delay(timestamp)
+            if delay > 0:
+                sleep(delay)
+            return frame
+        raise EOFError('回放结束')
+
+
+class AsyncFrameReplay(AsyncLiveMessage):
+    """
+    FrameReplay的异步版本, 用于asynchronous模式的Live
+    """
+
+    def __init__(self, path: str, logger: Log = void_loger, speed: float = 1.0, start: float = None, room_id=0):
+        super().__init__(room_id, logger)
+        self.reader = FrameReader(path)
+        self._frames = self.reader.frames(start)
+        self._pacer = _Pacer(speed)
+
+    async def connect(self) -> bool:
+        return True
+
+    async def reconnect(self) -> bool:
+        return True
+
+    def stalled(self) -> bool:
+        return False
+
+    async def recv_frame(self) -> bytes:
+        for timestamp, frame in self._frames:
+            delay = self._pacer.delay(timestamp)
+            await asyncio.sleep(delay if delay > 0 else 0)
+            return frame
+        raise EOFError('回放结束')
+
+    async def close(self):
+        pass
@@ -0,0 +1,252 @@
+import os
+import re
+from random import random, randrange
+from threading import Lock
+
+from .log import BaseLog, BackgroundFlusher, void_loger
+from .codec import Codec, get_codec
+
+MAX_DEPTH = 8  # 结构指纹与字段推断的最大嵌套深度
+LIST_PROBE = 4  # 列表只检查前几个元素
+SCALAR_TYPES = {bool: 'bool', int: 'int', float: 'float', str: 'str', type(None): 'null'}
+
+
+def shape(value, depth: int = 0):
+    """
+    结构指纹, 只保留字典的键与值的类型, 忽略具体取值
+    """
+    kind = type(value)
+    if kind is dict:
+        if depth >= MAX_DEPTH:
+            return 'object'
+        return tuple(sorted((key, shape(item, depth + 1)) for key, item in value.items()))
+    if kind is list:
+        if depth >= MAX_DEPTH:
+            return 'array'
+        return 'array', frozenset(shape(item, depth + 1) for item in value[:LIST_PROBE])
+    return SCALAR_TYPES.get(kind, kind.__name__)
+
+
+class _Schema:
+    """
+    由样本合并而来的字段结构, count为出现次数, objects为其中是字典的次数, 用于判断子字段是否可选
+    """
+    __slots__ = ('count', 'objects', 'types', 'fields', 'items', 'example')
+
+    def __init__(self):
+        self.count = 0
+        self.objects = 0
+        self.types = set()
+        self.fields = {}
+        self.items = None
+        self.example = None
+
+    def add(self, value, depth: int = 0):
+        self.count += 1
+        kind = type(value)
+        if kind is dict:
+            self.types.add('object')
+            self.objects += 1
+            if depth < MAX_DEPTH:
+                for key, item in value.items():
+                    node = self.fields.get(key)
+                    if node is None:
+                        node = self.fields[key] = _Schema()
+                    node.add(item, depth + 1)
+        elif kind is list:
+            self.types.add('array')
+            if depth < MAX_DEPTH:
+                for item in value[:LIST_PROBE]:
+                    if self.items is None:
+                        self.items = _Schema()
+                    self.items.add(item, depth + 1)
+        else:
+            self.types.add(SCALAR_TYPES.get(kind, kind.__name__))
+            if self.example is None and value is not None:
+                self.example = value[:40] if kind is str else value
+
+    def scalar_type(self) -> str:
+        """
+        除null外只有一种基本类型时返回该类型, 否则返回None
+        """
+        types = self.types - {'null'}
+        if len(types) == 1:
+            kind = next(iter(types))
+            if kind in ('bool', 'int', 'float', 'str'):
+                return kind
+
+    def to_dict(self, parent_objects: int = None) -> dict:
+        types = sorted(self.types)
+        result = {'type': types[0] if len(types) == 1 else types}
+        if parent_objects is not None and self.count < parent_objects:
+            result['optional'] = True
+        if self.example is not None:
+            result['example'] = self.example
+        if self.fields:
+            result['fields'] = {key: node.to_dict(self.objects) for key, node in self.fields.items()}
+        if self.items is not None:
+            result['items'] = self.items.to_dict()
+        return result
+
+
+class _CmdSample:
+    __slots__ = ('count', 'slots', 'shapes', 'schema', 'dirty', 'changed')
+
+    def __init__(self):
+        self.count = 0  # 收到的消息数
+        self.slots = []  # 蓄水池: [(结构指纹, 消息)]
+        self.shapes = {}  # 结构指纹 -> 蓄水池下标
+        self.schema = _Schema()
+        self.dirty = set()  # 尚未写入文件的下标
+        self.changed = False
+
+
+class SchemaSampler:
+    """
+    未知cmd的结构采样器, 每个cmd以蓄水池抽样保留至多size条结构互不相同的样本, 并合并推断字段结构
+    只有被蓄水池选中的消息才计算结构指纹, 其余消息只计数, 对分发几乎没有影响; 文件由后台线程定期批量写入:
+    directory/cmd/下标.json为样本, directory/cmd.schema.json为推断的字段结构
+    """
+
+    def __init__(self, directory: str = 'CmdJsonExample', size: int = 20, flush_interval: float = 5.0,
+                 max_cmds: int = 500, codec=None, logger: BaseLog = void_loger):
+        """
+        :param directory: 输出目录
+        :param size: 每个cmd保留的样本数
+        :param flush_interval: 写入间隔(秒)
+        :param max_cmds: 最多采样的cmd数, 超出后忽略新的cmd
+        :param codec: 写入文件使用的JSON编解码器, 见src.codec.get_codec
+        """
+        self.directory = directory
+        self.size = size
+        self.flush_interval = flush_interval
+        self.max_cmds = max_cmds
+        self.codec: Codec = get_codec(codec)
+        self.logger = logger
+        self._cmds = {}
+        self._lock = Lock()
+        self._flusher = BackgroundFlusher(self.flush, flush_interval).start()
+
+    def attach(self, live, cmds=None):
+        """
+        通过Live.observe采样Live或LiveHub的消息
+        :param cmds: 采样的cmd, 不填则采样所有没有消息处理器的cmd(与unregistered相同)
+        """
+        for cmd in cmds or ('UNREGISTERED',):
+            live.observe(cmd, self.observe)
+        return self
+
+    def observe(self, msg: dict):
+        cmd = msg.get('cmd')
+        sample = self._cmds.get(cmd)
+        if sample is None:
+            if len(self._cmds) >= self.max_cmds:
+                return
+            with self._lock:
+                sample = self._cmds[cmd] = _CmdSample()
+            self.logger.info(f'发现未知cmd: {cmd}')
+        sample.count += 1
+        if sample.count > self.size and random() * sample.count >= self.size:
+            return
+        fingerprint = hash(shape(msg))
+        with self._lock:
+            sample.schema.add(msg)
+            sample.changed = True
+            if fingerprint in sample.shapes:
+                return
+            slots = sample.slots
+            if len(slots) < self.size:
+                slot = len(slots)
+                slots.append(None)
+            else:
+                slot = randrange(self.size)
+                del sample.shapes[slots[slot][0]]
+            slots[slot] = (fingerprint, msg)
+            sample.shapes[fingerprint] = slot
+            sample.dirty.add(slot)
+
+    def cmds(self) -> dict:
+        """
+        :return: cmd -> 收到的消息数
+        """
+        return {cmd: sample.count for cmd, sample in list(self._cmds.items())}
+
+    def samples(self, cmd: str) -> list:
+        with self._lock:
+            return [msg for _, msg in self._cmds[cmd].slots]
+
+    def schema(self, cmd: str) -> dict:
+        with self._lock:
+            return self._cmds[cmd].schema.to_dict()
+
+    def model_source(self, cmd: str, max_depth: int = 3) -> str:
+        """
+        根据推断的字段结构生成src.messages中消息类的代码草稿, 只包含类型唯一的基本类型字段, 需人工检查字段名与含义
+        """
+        with self._lock:
+            schema = self._cmds[cmd].schema
+            leaves = []
+
+            def walk(node: _Schema, path: tuple):
+                for key, child in node.fields.items():
+                    if not path and key in ('cmd', 'room_id'):
+                        continue
+                    kind = child.scalar_type()
+                    if kind is not None:
+                        leaves.append((path + (key,), kind, child.example))
+                    elif 'object' in child.types and len(path) + 1 < max_depth:
+                        walk(child, path + (key,))
+
+            walk(schema, ())
+        class_name = ''.join(part.capitalize() for part in cmd.lower().split('_'))
+        lines = [f"class {class_name}(Message, cmd='{cmd}'):", '    """', f'    {cmd}', '    """',
+                 '    __slots__ = ()', f"    NAME = '{cmd}'", '']
+        names = set()
+        for path, kind, example in leaves:
+            name = _field_name(path[-1])
+            if name in names or not name.isidentifier():
+                name = _field_name('_'.join(str(key) for key in path[1:] or path))
+            if not name.isidentifier():
+                name = 'field_' + name
+            names.add(name)
+            comment = '' if example is None else f'  # 例: {example!r}'
+            lines.append(f"    {name}: {kind} = Field({', '.join(repr(key) for key in path)}){comment}")
+        return '\n'.join(lines) + '\n'
+
+    def flush(self):
+        """
+        写入有变化的样本与字段结构, 由BackgroundFlusher调用
+        """
+        jobs = []
+        with self._lock:
+            for cmd, sample in self._cmds.items():
+                if sample.changed:
+                    items = [(slot, sample.slots[slot][1]) for slot in sample.dirty]
+                    jobs.append((cmd, items, {'cmd': cmd, 'count': sample.count, 'samples': len(sample.slots),
+                                              'schema': sample.schema.to_dict()}))
+                    sample.dirty.clear()
+                    sample.changed = False
+        for cmd, items, schema in jobs:
+            name = re.sub(r'[^\w.-]', '_', str(cmd))
+            try:
+                if items:
+                    cmd_dir = os.path.join(self.directory, name)
+                    os.makedirs(cmd_dir, exist_ok=True)
+                    for slot, msg in items:
+                        with open(os.path.join(cmd_dir, f'{slot}.json'), 'wb') as f:
+                            f.write(self.codec.dumps(msg, pretty=True))
+                with open(os.path.join(self.directory, f'{name}.schema.json'), 'wb') as f:
+                    f.write(self.codec.dumps(schema, pretty=True))
+            except (OSError, TypeError, ValueError) as exc:
+                self.logger.error(f'采样 {cmd} 写入失败: {repr(exc)}')
+
+    def close(self):
+        self._flusher.close()
+
+
+def _field_name(key: str) -> str:
+    """
+    驼峰命名转为下划线命名
+    """
+    name = re.sub(r'(?<=[a-z0-9])([A-Z])', r'_\1', str(key)).lower()
+    return re.sub(r'\W', '_', name)
@@ -0,0 +1,252 @@
+import os
+import pickle
+import asyncio
+import multiprocessing
+from multiprocessing.connection import wait
+from threading import Thread, Lock
+from typing import Union
+from concurrent.futures import Executor
+
+from .log import Log, void_loger
+from .metrics import Metrics
+from .crawler import BaseLive, shared_loop
+from .hub import LiveHub
+
+
+class _WorkerHub(LiveHub):
+    """
+    工作进程中的LiveHub, 不运行消息处理器, 只把主进程需要的消息分批发送给主进程
+    """
+
+    def __init__(self, conn, flush_interval: float, **options):
+        super().__init__(**options)
+        self.conn = conn
+        self.flush_interval = flush_interval
+        self._outbox = []
+
+    def want(self, cmds: list):
+        """
+        更新主进程注册了消息处理器的cmd, 分发规则与主进程一致
+        """
+        self._coroutines.clear()
+        self._coroutines.update({cmd: [None] for cmd in cmds})
+        self._rebuild_dispatch()
+
+    def _dispatch_batch(self, msgs: list):
+        table, fallback = self._dispatch
+        self._outbox.extend(msg for msg in msgs if table.get(msg.get('cmd'), fallback))
+
+    def _dispatch_state(self, msg: dict):
+        self._outbox.append(msg)
+
+    async def flush_forever(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._outbox:
+                batch, self._outbox = self._outbox, []
+                self.conn.send_bytes(pickle.dumps(batch, pickle.HIGHEST_PROTOCOL))
+
+
+def _worker_main(conn, flush_interval: float, room_options: dict):
+    """
+    工作进程入口, 从管道接收主进程的命令, 主进程退出时管道关闭, 工作进程随之退出
+    """
+    loop = asyncio.new_event_loop()
+    Thread(target=loop.run_forever, daemon=True).start()
+    hub = _WorkerHub(conn, flush_interval, loop=loop, lazy_json=True, **room_options)
+    hub.run(block=False)
+    asyncio.run_coroutine_threadsafe(hub.flush_forever(), loop)
+    while True:
+        try:
+            command, arg = conn.recv()
+        except (EOFError, OSError):
+            break
+        if command == 'add':
+            hub.add(arg[0], **arg[1])
+        elif command == 'remove':
+            hub.remove(arg)
+        elif command == 'want':
+            loop.call_soon_threadsafe(hub.want, arg)
+        elif command == 'close':
+            break
+    hub.close()
+
+
+class _Shard:
+    __slots__ = ('index', 'process', 'conn', 'rooms', 'lock')
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.rooms = {}  # 房间号 -> 房间参数
+        self.lock = Lock()
+
+    def send(self, command: str, arg=None):
+        with self.lock:
+            try:
+                self.conn.send((command, arg))
+            except (OSError, ValueError):
+                pass
+
+
+class ShardedHub(BaseLive):
+    """
+    将房间分散到多个工作进程中连接与解析, 绕开GIL对解压与JSON解析的限制
+    工作进程只解析主进程注册了消息处理器的cmd, 并通过管道分批发送给主进程, 消息处理器在主进程的事件循环中运行
+    工作进程使用spawn方式启动, 启动脚本需要放在if __name__ == '__main__'中
+    """
+
+    def __init__(self, workers: int = None, logger: Log = void_loger, loop: asyncio.AbstractEventLoop = None,
+                 executor: Union[str, Executor] = None, max_workers: int = None, metrics: Metrics = None,
+                 flush_interval: float = 0.02, **room_options):
+        """
+        :param workers: 工作进程数, 不填则为CPU核数
+        :param flush_interval: 工作进程发送消息的间隔(秒), 间隔内的消息合并为一批
+        :param room_options: 每个房间的默认参数, 如standby、hedge, 见Live.__init__
+        其余参数与LiveHub.__init__相同
+        """
+        self._running = False
+        super().__init__(logger, True, loop, False, executor, max_workers, metrics)
+        self.workers = workers or os.cpu_count() or 1
+        self.flush_interval = flush_interval
+        self.room_options = room_options
+        self.rooms = {}  # 房间号 -> 所在的工作进程序号
+        self.restarts = 0
+        self._shards = [_Shard(index) for index in range(self.workers)]
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = Lock()
+
+    def _wanted(self) -> list:
+        wanted = [cmd for cmd, coro_list in self._coroutines.items() if coro_list]
+        return wanted + [''] if self.taps else wanted
+
+    def _rebuild_dispatch(self):
+        super()._rebuild_dispatch()
+        if self._running:
+            wanted = self._wanted()
+            for shard in self._shards:
+                shard.send('want', wanted)
+
+    def _start_shard(self, shard: _Shard):
+        parent_conn, child_conn = self._context.Pipe()
+        shard.process = self._context.Process(target=_worker_main, name=f'BiLiveir-shard-{shard.index}',
+                                              args=(child_conn, self.flush_interval, self.room_options), daemon=True)
+        shard.process.start()
+        child_conn.close()
+        shard.conn = parent_conn
+        shard.send('want', self._wanted())
+        for room_id, options in shard.rooms.items():
+            shard.send('add', (room_id, options))
+
+    def _restart(self, shard: _Shard):
+        self.logger.warn(f'工作进程 {shard.index} 退出(exitcode={shard.process.exitcode}), 重新启动')
+        shard.conn.close()
+        shard.process.join(1)
+        self.restarts += 1
+        self._start_shard(shard)
+
+    def add(self, room_id: int, **options) -> int:
+        """
+        添加房间, 分配到房间数最少的工作进程
+        :return: 工作进程序号
+        """
+        with self._lock:
+            if room_id in self.rooms:
+                return self.rooms[room_id]
+            shard = min(self._shards, key=lambda s: len(s.rooms))
+            self._place(room_id, options, shard)
+            return shard.index
+
+    def _place(self, room_id: int, options: dict, shard: _Shard):
+        shard.rooms[room_id] = options
+        self.rooms[room_id] = shard.index
+        if self._running:
+            shard.send('add', (room_id, options))
+
+    def remove(self, room_id: int) -> bool:
+        """
+        移除房间, 随后把房间从最多的工作进程移动到最少的工作进程, 使各进程的房间数之差不超过1
+        """
+        with self._lock:
+            index = self.rooms.pop(room_id, None)
+            if index is None:
+                return False
+            shard = self._shards[index]
+            del shard.rooms[room_id]
+            if self._running:
+                shard.send('remove', room_id)
+            self._rebalance()
+            return True
+
+    def _rebalance(self):
+        while True:
+            low = min(self._shards, key=lambda s: len(s.rooms))
+            high = max(self._shards, key=lambda s: len(s.rooms))
+            if len(high.rooms) - len(low.rooms) <= 1:
+                return
+            room_id = next(iter(high.rooms))
+            options = high.rooms.pop(room_id)
+            if self._running:
+                high.send('remove', room_id)
+            self._place(room_id, options, low)
+            self.logger.info(f'房间 {room_id} 从工作进程 {high.index} 移动到 {low.index}')
+
+    def _deliver(self, batch: list):
+        msgs = []
+        for msg in batch:
+            if msg.get('cmd') == 'CONNECTION_STATE':
+                self._dispatch_state(msg)
+            else:
+                msgs.append(msg)
+        self._dispatch_batch(msgs)
+
+    def _receive(self):
+        """
+        接收线程, 同时等待所有工作进程的管道与进程句柄, 进程退出时重新启动并恢复其房间
+        """
+        while self._running:
+            handles = {}
+            for shard in self._shards:
+                handles[shard.conn] = (shard, shard.process)
+                handles[shard.process.sentinel] = (shard, shard.process)
+            for ready in wait(list(handles), timeout=1.0):
+                shard, process = handles[ready]
+                if shard.process is not process or not self._running:
+                    continue
+                if ready is shard.conn:
+                    try:
+                        data = shard.conn.recv_bytes()
+                    except (EOFError, OSError):
+                        with self._lock:
+                            self._restart(shard)
+                        continue
+                    self.loop.call_soon_threadsafe(self._deliver, pickle.loads(data))
+                elif not process.is_alive():
+                    with self._lock:
+                        self._restart(shard)
+
+    def run(self, block=True):
+        if self.loop is None:
+            self.loop = shared_loop()
+        with self._lock:
+            for shard in self._shards:
+                self._start_shard(shard)
+            self._running = True
+        Thread(target=self._receive, daemon=True).start()
+        while block and input() not in ('q', 'quit', 'exit'):
+            pass
+        return self
+
+    def close(self):
+        """
+        通知所有工作进程退出
+        """
+        self._running = False
+        for shard in self._shards:
+            if shard.process is not None:
+                shard.send('close')
+                shard.process.join(5)
+                if shard.process.is_alive():
+                    shard.process.terminate()
+                shard.conn.close()
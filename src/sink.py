@@ -0,0 +1,267 @@
+import os
+import json
+import sqlite3
+from time import time
+from datetime import datetime
+from collections import deque, Counter, OrderedDict
+
+from .log import BaseLog, BackgroundFlusher, void_loger
+from .messages import MESSAGES
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+ARCHIVE_CMDS = ('DANMU_MSG', 'SUPER_CHAT_MESSAGE', 'SUPER_CHAT_MESSAGE_JPN', 'SEND_GIFT', 'GUARD_BUY')
+SCALARS = (int, float, str, bool, type(None))
+
+
+def _columns(model) -> tuple:
+    """
+    :return: ((字段名, 注解类型), ...), 注解不是基本类型的字段按str处理
+    """
+    annotations = {}
+    for klass in reversed(model.__mro__):
+        annotations.update(getattr(klass, '__annotations__', {}))
+    return tuple((name, annotations.get(name) if annotations.get(name) in (int, float, str, bool) else str)
+                 for name in model.fields())
+
+
+def _scalar(value):
+    return value if isinstance(value, SCALARS) else json.dumps(value, ensure_ascii=False)
+
+
+def _convert(value, kind):
+    """
+    按注解类型转换字段值, 用于列式文件的固定类型列, 无法转换时为None
+    """
+    if value is None or isinstance(value, kind):
+        return value
+    if kind is str:
+        return _scalar(value)
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class _Table:
+    """
+    一个cmd对应的表结构
+    """
+    __slots__ = ('cmd', 'name', 'model', 'columns', 'insert', 'create', 'schema')
+
+    def __init__(self, cmd: str, raw: bool):
+        self.cmd = cmd
+        self.name = cmd.lower()
+        self.model = MESSAGES[cmd]
+        self.columns = _columns(self.model)
+        names = ['recv_time'] + [name for name, _ in self.columns] + (['raw'] if raw else [])
+        self.create = f'CREATE TABLE IF NOT EXISTS {self.name} ({", ".join(names)})'
+        self.insert = f'INSERT INTO {self.name} VALUES ({", ".join("?" * len(names))})'
+        self.schema = None
+        if pyarrow is not None:
+            types = {int: pyarrow.int64(), float: pyarrow.float64(), str: pyarrow.string(), bool: pyarrow.bool_()}
+            self.schema = pyarrow.schema([('recv_time', pyarrow.float64())] +
+                                         [(name, types[kind]) for name, kind in self.columns] +
+                                         ([('raw', pyarrow.string())] if raw else []))
+
+
+class Sink:
+    """
+    消息归档, 按房间与日期分区批量写入SQLite(WAL模式)和/或Parquet列式文件
+    分发时只把消息放入缓冲, 字段提取与写入都在后台线程中进行, 缓冲达到batch_size条或每隔flush_interval秒写入一次
+    SQLite: directory/房间号/日期.db, 每个cmd一张表; Parquet: directory/房间号/日期/cmd.parquet
+    每个分区的Parquet消息攒够row_group_size条或最早一条等待超过row_group_interval秒才写入一个行组, 避免产生大量小行组;
+    同时打开的SQLite与Parquet文件数各不超过max_open, 被关闭的Parquet分区之后写入新文件
+    """
+    SQLITE = 'sqlite'
+    PARQUET = 'parquet'
+    FORMATS = (SQLITE, PARQUET)
+
+    def __init__(self, directory: str = 'archive', cmds=ARCHIVE_CMDS, formats=(SQLITE,), batch_size: int = 2000,
+                 flush_interval: float = 1.0, raw: bool = False, max_open: int = 64, row_group_size: int = 10000,
+                 row_group_interval: float = 60.0, logger: BaseLog = void_loger):
+        """
+        :param directory: 归档目录
+        :param cmds: 归档的cmd, 必须在MESSAGES中有对应的消息类
+        :param formats: 输出格式, 见Sink.FORMATS, parquet需要安装pyarrow
+        :param batch_size: 缓冲达到该条数时立即写入
+        :param flush_interval: 最长写入间隔(秒)
+        :param raw: 是否同时保存原始消息的JSON
+        :param max_open: 同时打开的SQLite分区数与Parquet文件数, 超出后关闭最久未写入的
+        :param row_group_size: Parquet每个行组的条数
+        :param row_group_interval: Parquet未写入的消息最长等待时间(秒), 超时后不足row_group_size条也写入
+        """
+        for fmt in formats:
+            if fmt not in self.FORMATS:
+                raise ValueError(f'未知归档格式: {fmt}, 可选: {self.FORMATS}')
+        if self.PARQUET in formats and pyarrow is None:
+            raise ImportError('parquet格式需要安装pyarrow')
+        self.directory = directory
+        self.formats = tuple(formats)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.raw = raw
+        self.max_open = max_open
+        self.row_group_size = row_group_size
+        self.row_group_interval = row_group_interval
+        self.logger = logger
+        self.tables = {cmd: _Table(cmd, raw) for cmd in cmds}
+        self.written = Counter()  # 已写入的消息, 按cmd
+        self.errors = 0  # 写入失败而丢弃的消息数
+        self._buffer = deque()
+        self._databases = OrderedDict()  # (房间号, 日期) -> sqlite3.Connection
+        self._writers = OrderedDict()  # (房间号, 日期, cmd) -> ParquetWriter
+        self._pending = {}  # (房间号, 日期, cmd) -> (最早一条的放入时间, 尚未写入Parquet的[(接收时间, 消息)])
+        self._day_cache = (None, '')
+        self._flusher = BackgroundFlusher(self.flush, flush_interval).start()
+
+    def attach(self, live):
+        """
+        归档Live或LiveHub的消息, 单个Live的消息按其房间号分区
+        """
+        room_id = getattr(live, 'room_id', None)
+        for cmd in self.tables:
+            live.observe(cmd, lambda msg, _cmd=cmd, default=room_id: self.put(_cmd, msg, default))
+        return self
+
+    def put(self, cmd: str, msg: dict, room_id=None):
+        """
+        放入一条消息, 可在任意线程调用
+        """
+        self._buffer.append((cmd, msg.get('room_id', room_id), time(), msg))
+        if len(self._buffer) >= self.batch_size:
+            self._flusher.wake()
+
+    def _day(self, timestamp: float) -> str:
+        second = int(timestamp)
+        if self._day_cache[0] != second:
+            self._day_cache = (second, datetime.fromtimestamp(second).strftime('%Y-%m-%d'))
+        return self._day_cache[1]
+
+    def _database(self, room_id, day: str) -> sqlite3.Connection:
+        key = (room_id, day)
+        conn = self._databases.get(key)
+        if conn is None:
+            room_dir = os.path.join(self.directory, str(room_id))
+            os.makedirs(room_dir, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(room_dir, f'{day}.db'), check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for table in self.tables.values():
+                conn.execute(table.create)
+            self._databases[key] = conn
+            while len(self._databases) > self.max_open:
+                self._databases.popitem(last=False)[1].close()
+        else:
+            self._databases.move_to_end(key)
+        return conn
+
+    def _writer(self, room_id, day: str, table: _Table):
+        key = (room_id, day, table.cmd)
+        writer = self._writers.get(key)
+        if writer is None:
+            day_dir = os.path.join(self.directory, str(room_id), day)
+            os.makedirs(day_dir, exist_ok=True)
+            path, index = os.path.join(day_dir, f'{table.name}.parquet'), 1
+            while os.path.exists(path):  # parquet文件不能追加, 重启后写入新文件
+                path, index = os.path.join(day_dir, f'{table.name}.{index}.parquet'), index + 1
+            writer = self._writers[key] = pyarrow.parquet.ParquetWriter(path, table.schema, compression='zstd')
+            while len(self._writers) > self.max_open:
+                self._writers.popitem(last=False)[1].close()
+        else:
+            self._writers.move_to_end(key)
+        return writer
+
+    def _write(self, room_id, day: str, cmd: str, items: list):
+        table = self.tables[cmd]
+        if self.SQLITE in self.formats:
+            rows = []
+            for recv_time, msg in items:
+                message = table.model(msg)
+                row = [recv_time] + [_scalar(getattr(message, name)) for name, _ in table.columns]
+                if self.raw:
+                    row.append(json.dumps(msg, ensure_ascii=False))
+                rows.append(row)
+            conn = self._database(room_id, day)
+            with conn:
+                conn.executemany(table.insert, rows)
+        if self.PARQUET in self.formats:
+            key = (room_id, day, cmd)
+            if key not in self._pending:
+                self._pending[key] = (time(), [])
+            pending = self._pending[key][1]
+            pending.extend(items)
+            if len(pending) >= self.row_group_size:
+                del self._pending[key]
+                self._write_parquet(room_id, day, table, pending)
+
+    def _write_parquet(self, room_id, day: str, table: _Table, items: list):
+        messages = [table.model(msg) for _, msg in items]
+        data = {'recv_time': [recv_time for recv_time, _ in items]}
+        for name, kind in table.columns:
+            data[name] = [_convert(getattr(message, name), kind) for message in messages]
+        if self.raw:
+            data['raw'] = [json.dumps(msg, ensure_ascii=False) for _, msg in items]
+        self._writer(room_id, day, table).write_table(pyarrow.table(data, schema=table.schema))
+
+    def _flush_pending(self, keys: list):
+        """
+        写入指定分区中未满一个行组的消息
+        """
+        for key in keys:
+            _, items = self._pending.pop(key)
+            room_id, day, cmd = key
+            try:
+                self._write_parquet(room_id, day, self.tables[cmd], items)
+            except Exception as exc:
+                self.errors += len(items)
+                self.logger.error(f'归档 {room_id}/{day}/{cmd} 写入失败, 丢弃{len(items)}条: {repr(exc)}')
+
+    def flush(self):
+        """
+        将缓冲写入文件, 每个分区一个事务, 由BackgroundFlusher调用
+        """
+        buffer = self._buffer
+        partitions = {}
+        for _ in range(len(buffer)):
+            cmd, room_id, recv_time, msg = buffer.popleft()
+            key = (room_id, self._day(recv_time), cmd)
+            items = partitions.get(key)
+            if items is None:
+                items = partitions[key] = []
+            items.append((recv_time, msg))
+        for (room_id, day, cmd), items in partitions.items():
+            try:
+                self._write(room_id, day, cmd, items)
+                self.written[cmd] += len(items)
+            except Exception as exc:
+                self.errors += len(items)
+                self.logger.error(f'归档 {room_id}/{day}/{cmd} 写入失败, 丢弃{len(items)}条: {repr(exc)}')
+        now = time()
+        deadline = now - self.row_group_interval
+        self._flush_pending([key for key, (since, _) in self._pending.items() if since <= deadline])
+        self._close_days(self._day(now))
+
+    def _close_days(self, today: str):
+        """
+        关闭已过日期的分区, parquet文件在关闭时才写入文件尾
+        """
+        for key in [key for key in self._databases if key[1] < today]:
+            self._databases.pop(key).close()
+        self._flush_pending([key for key in self._pending if key[1] < today])
+        for key in [key for key in self._writers if key[1] < today]:
+            self._writers.pop(key).close()
+
+    def close(self):
+        self._flusher.close()
+        self._flush_pending(list(self._pending))
+        for conn in self._databases.values():
+            conn.close()
+        for writer in self._writers.values():
+            writer.close()
+        self._databases.clear()
+        self._writers.clear()
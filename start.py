@@ -1,8 +1,4 @@
-import os
-import json
-from random import randint
-
-from src import Live, Log, messages
+from src import Live, Log, SchemaSampler, messages
 
 log = Log('log.txt')
 live = Live(22889484, log)
@@ -38,16 +34,8 @@ async def guard_buy(msg: dict):
     log.info(f"{data['username']} 成为了 {data['gift_name']}")
 
 
-@live.unregistered
-async def unregistered(data: dict):
-    cmd = data.get('cmd')
-    log.debug(f'收到包: {cmd}')
-    cmd_dir = f'CmdJsonExample/{cmd}'
-    if not os.path.exists(cmd_dir):
-        os.mkdir(cmd_dir)
-    file_path = f'{cmd_dir}/{randint(0, 99)}.json'
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+# 未注册的cmd按结构采样到CmdJsonExample, 并推断字段结构, 见SchemaSampler.model_source
+sampler = SchemaSampler('CmdJsonExample', logger=log).attach(live)
 
 
 live.run(block=True)
@@ -0,0 +1,37 @@
+import zlib
+import struct
+
+import pytest
+
+from src.crawler import BaseLiveMessage
+from src.log import void_loger
+from benchmarks.frames import frame, packet
+
+GOOD = b'{"cmd":"DANMU_MSG"}'
+
+
+def decode(message: bytes) -> list:
+    return [(operation, bytes(body)) for operation, body in BaseLiveMessage(1, void_loger).decode_msg(message)]
+
+
+@pytest.mark.parametrize('header', [
+    struct.pack('>IHHII', 0, 0, 0, 1, 0),  # 包长度为0
+    struct.pack('>IHHII', 0, 16, 0, 5, 0),  # 包长度小于消息头长度
+    struct.pack('>IHHII', 16, 0, 0, 5, 0),  # 消息头长度为0
+    struct.pack('>IHHII', 8, 8, 0, 5, 0),  # 消息头长度小于16
+    struct.pack('>IHHII', 1000, 16, 0, 5, 0),  # 包长度超出数据
+])
+def test_corrupt_header(header):
+    assert decode(packet(GOOD) + header + b'\x00' * 16) == [(5, GOOD)]
+
+
+def test_truncated():
+    data = frame([GOOD, GOOD], 'none')
+    assert decode(data[:-1]) == [(5, GOOD)]
+    assert decode(data[:10]) == []
+
+
+def test_corrupt_header_inside_compressed():
+    inner = packet(GOOD) + struct.pack('>IHHII', 0, 0, 0, 5, 0)
+    data = packet(zlib.compress(inner), protover=2) + packet(GOOD)
+    assert decode(data) == [(5, GOOD), (5, GOOD)]
@@ -0,0 +1,26 @@
+from src.dedup import Deduplicator
+
+COUNT = b'{"cmd":"ONLINE_RANK_COUNT","data":{"count":771}}'
+DANMU = b'{"cmd":"DANMU_MSG","info":[[0],"hi",[1,"u"]]}'
+
+
+def bodies(packets: list) -> list:
+    return [bytes(body) for cmd, body in packets]
+
+
+def test_repeats_on_same_connection_are_kept():
+    dedup = Deduplicator()
+    a = object()
+    assert bodies(dedup.filter([('ONLINE_RANK_COUNT', memoryview(COUNT))], True, a)) == [COUNT]
+    assert bodies(dedup.filter([('ONLINE_RANK_COUNT', memoryview(COUNT))], True, a)) == [COUNT]
+    assert dedup.duplicates == 0
+
+
+def test_copies_from_other_connections_are_dropped():
+    dedup = Deduplicator()
+    a, b = object(), object()
+    assert bodies(dedup.filter([('DANMU_MSG', memoryview(DANMU))], False, b)) == [DANMU]
+    assert dedup.filter([('DANMU_MSG', memoryview(DANMU))], True, a) == []
+    assert bodies(dedup.filter([('ONLINE_RANK_COUNT', memoryview(COUNT))] * 2, True, a)) == [COUNT, COUNT]
+    assert dedup.filter([('ONLINE_RANK_COUNT', memoryview(COUNT))] * 2, False, b) == []
+    assert dedup.duplicates == 3
@@ -0,0 +1,46 @@
+import json
+import time
+
+import pytest
+
+from src import Live
+from src.filters import compile_filter
+from src.messages import MESSAGES
+from src.replay import FrameRecorder, FrameReplay, AsyncFrameReplay
+from benchmarks.frames import frame
+
+MALFORMED = [
+    {'cmd': 'GUARD_BUY', 'data': {'uid': 1, 'username': 'a', 'gift_name': '舰长'}},  # 缺少price
+    {'cmd': 'SEND_GIFT', 'data': {'uid': 2, 'uname': 'b', 'coin_type': 'gold', 'total_coin': '100'}},  # 类型错误
+    {'cmd': 'DANMU_MSG', 'info': [[0, 1, 25, 16777215, 1671458055539], 'after', [3, 'c']]},
+]
+
+
+def wait_for(received: list, count: int, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while len(received) < count and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+
+def test_match_errors_filter_out():
+    match = compile_filter(MESSAGES['SEND_GIFT'], min_price=100)
+    assert match(MALFORMED[1]) is False
+    assert compile_filter(MESSAGES['GUARD_BUY'], min_price=100)(MALFORMED[0]) is False
+
+
+@pytest.mark.parametrize('asynchronous', [False, True])
+def test_malformed_payload_past_filter(tmp_path, asynchronous):
+    path = str(tmp_path / 'room.bilr')
+    recorder = FrameRecorder(path)
+    recorder.write(frame([json.dumps(msg).encode('utf-8') for msg in MALFORMED], 'zlib'))
+    recorder.close()
+    received, paid = [], []
+    web = AsyncFrameReplay(path, speed=0) if asynchronous else FrameReplay(path, speed=0)
+    live = Live(1, asynchronous=asynchronous, web=web)
+    live.guard_buy(paid.append, min_price=100)
+    live.send_gift(paid.append, min_price=100)
+    live.danmu_msg(lambda msg: received.append(msg.message))
+    live.run(block=False)
+    wait_for(received, 1)
+    assert received == ['after']
+    assert paid == []
@@ -0,0 +1,16 @@
+import pickle
+
+from src import Live
+from src.crawler import BaseLiveMessage
+from src.log import void_loger
+
+
+def on_danmu(msg):
+    return msg.message
+
+
+def test_typed_decorator_returns_function():
+    live = Live(1, web=BaseLiveMessage(1, void_loger))
+    assert live.danmu_msg(on_danmu) is on_danmu
+    assert live.danmu_msg(executor='process', timeout=5)(on_danmu) is on_danmu
+    assert pickle.loads(pickle.dumps(on_danmu)) is on_danmu
@@ -0,0 +1,43 @@
+import time
+
+from src.log import BackgroundFlusher, BufferedLog, StructuredLog, LogReader
+from src.sampler import SchemaSampler
+
+
+def test_flusher_survives_errors():
+    calls = []
+
+    def flush():
+        calls.append(None)
+        if len(calls) == 1:
+            raise OSError('disk full')
+
+    flusher = BackgroundFlusher(flush, 3600).start()
+    for count in (1, 2):
+        flusher.wake()
+        deadline = time.monotonic() + 5
+        while len(calls) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+    assert len(calls) == 2
+    flusher.close()
+    assert not flusher._thread.is_alive()
+    count = len(calls)
+    flusher.close()
+    assert len(calls) == count + 1
+
+
+def test_close_flushes(tmp_path):
+    log = BufferedLog(str(tmp_path / 'a.log'), echo=False, flush_interval=3600)
+    log.info('hello')
+    log.close()
+    assert (tmp_path / 'a.log').read_text(encoding='utf-8').endswith('hello\n')
+
+    structured = StructuredLog(str(tmp_path / 'logs'), flush_interval=3600)
+    structured.record({'cmd': 'DANMU_MSG'}, room_id=1)
+    structured.close()
+    assert len(list(LogReader(str(tmp_path / 'logs')).query())) == 1
+
+    sampler = SchemaSampler(str(tmp_path / 'samples'), flush_interval=3600)
+    sampler.observe({'cmd': 'NEW_CMD', 'data': {'a': 1}})
+    sampler.close()
+    assert (tmp_path / 'samples' / 'NEW_CMD.schema.json').exists()
@@ -0,0 +1,49 @@
+import json
+import time
+
+import pytest
+
+from src import Live
+from src.replay import FrameRecorder, FrameReplay, AsyncFrameReplay
+from benchmarks.frames import frame, brotli
+
+DANMU = [{'cmd': 'DANMU_MSG', 'info': [[0, 1, 25, 16777215, 1671458055539 + i], f'hi{i}', [i, f'u{i}']]}
+         for i in range(10)]
+COMPRESSIONS = ['zlib'] + (['brotli'] if brotli is not None else [])
+
+
+def record(path: str, compression: str) -> str:
+    recorder = FrameRecorder(path, block_frames=2)
+    bodies = [json.dumps(msg, separators=(',', ':')).encode('utf-8') for msg in DANMU]
+    for i in range(0, len(bodies), 3):
+        recorder.write(frame(bodies[i:i + 3], compression))
+    recorder.close()
+    return path
+
+
+def wait_for(received: list, count: int, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while len(received) < count and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_replay_compressed(tmp_path, compression):
+    path = record(str(tmp_path / 'room.bilr'), compression)
+    received = []
+    live = Live(1, web=FrameReplay(path, speed=0))
+    live.danmu_msg(lambda msg: received.append(msg.message))
+    live.run(block=False)
+    wait_for(received, len(DANMU))
+    assert received == [msg['info'][1] for msg in DANMU]
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_async_replay_compressed(tmp_path, compression):
+    path = record(str(tmp_path / 'room.bilr'), compression)
+    received = []
+    live = Live(1, asynchronous=True, web=AsyncFrameReplay(path, speed=0))
+    live.danmu_msg(lambda msg: received.append(msg.message))
+    live.run(block=False)
+    wait_for(received, len(DANMU))
+    assert received == [msg['info'][1] for msg in DANMU]
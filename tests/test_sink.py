@@ -0,0 +1,53 @@
+import os
+import time
+
+import pytest
+
+from src.sink import Sink
+
+pyarrow = pytest.importorskip('pyarrow')
+import pyarrow.parquet  # noqa: E402
+
+
+def danmu(i: int) -> dict:
+    return {'cmd': 'DANMU_MSG', 'info': [[0, 1, 25, 16777215, 1671458055539], f'hi{i}', [i, f'u{i}']]}
+
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+
+def parquet_files(directory: str) -> dict:
+    """
+    :return: 文件路径 -> 行数, 未关闭的文件没有文件尾, 读取时会报错
+    """
+    return {os.path.relpath(os.path.join(root, name), directory):
+            pyarrow.parquet.read_metadata(os.path.join(root, name)).num_rows
+            for root, _, names in os.walk(directory) for name in names if name.endswith('.parquet')}
+
+
+def test_parquet_writers_limited(tmp_path):
+    sink = Sink(str(tmp_path), formats=(Sink.PARQUET,), flush_interval=0.05, max_open=4, row_group_size=5)
+    for i in range(100):
+        sink.put('DANMU_MSG', danmu(i), room_id=i % 10)
+    wait_until(lambda: sink.written['DANMU_MSG'] == 100)
+    assert len(sink._writers) == 4
+    for i in range(5):
+        sink.put('DANMU_MSG', danmu(i), room_id=0)
+    sink.close()
+    files = parquet_files(str(tmp_path))
+    assert sum(files.values()) == 105
+    assert len(files) == 11
+    assert len([path for path in files if path.startswith('0' + os.sep)]) == 2
+
+
+def test_parquet_row_group_interval(tmp_path):
+    sink = Sink(str(tmp_path), formats=(Sink.PARQUET,), flush_interval=0.05, row_group_interval=0)
+    for i in range(3):
+        sink.put('DANMU_MSG', danmu(i), room_id=1)
+    wait_until(lambda: sink.written['DANMU_MSG'] == 3 and not sink._pending)
+    assert not sink._pending and len(sink._writers) == 1
+    sink.close()
+    assert list(parquet_files(str(tmp_path)).values()) == [3]